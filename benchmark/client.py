@@ -0,0 +1,142 @@
+"""
+Per-call overhead of building a compute client, before and after the
+process-wide client factory, using a fake discovery document and fake HTTP
+so no GCP project or network is needed.
+
+    python benchmark/client.py --calls 20 --latency 0.2
+"""
+
+import argparse
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import googleapiclient.discovery
+import httplib2
+from ondemand_dask import client
+
+
+def fake_document(resources = 60, methods = 20):
+    parameter = {'type': 'string', 'required': True, 'location': 'path'}
+    document = {
+        'kind': 'discovery#restDescription',
+        'discoveryVersion': 'v1',
+        'id': 'compute:v1',
+        'name': 'compute',
+        'version': 'v1',
+        'rootUrl': 'https://compute.googleapis.com/',
+        'servicePath': 'compute/v1/',
+        'batchPath': 'batch/compute/v1',
+        'parameters': {},
+        'schemas': {},
+        'resources': {},
+    }
+    for r in range(resources):
+        document['resources'][f'resource{r}'] = {
+            'methods': {
+                f'method{m}': {
+                    'id': f'compute.resource{r}.method{m}',
+                    'path': 'projects/{project}/zones/{zone}/resource/{name}',
+                    'httpMethod': 'GET',
+                    'parameters': {
+                        'project': parameter,
+                        'zone': parameter,
+                        'name': parameter,
+                    },
+                    'parameterOrder': ['project', 'zone', 'name'],
+                }
+                for m in range(methods)
+            }
+        }
+    return json.dumps(document)
+
+
+class FakeHttp:
+    def __init__(self, document, latency):
+        self.document = document
+        self.latency = latency
+
+    def request(self, uri, method = 'GET', body = None, headers = None, **kwargs):
+        time.sleep(self.latency)
+        return httplib2.Response({'status': '200'}), self.document.encode()
+
+
+def timeit(func, calls):
+    times = []
+    for _ in range(calls):
+        before = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - before)
+    return sum(times) / len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type = int, default = 20)
+    parser.add_argument(
+        '--latency',
+        type = float,
+        default = 0.2,
+        help = 'seconds to fetch discovery document',
+    )
+    args = parser.parse_args()
+
+    document = fake_document()
+
+    build_kwargs = {'cache_discovery': False}
+    if 'static_discovery' in inspect.signature(
+        googleapiclient.discovery.build
+    ).parameters:
+        build_kwargs['static_discovery'] = False
+
+    def before():
+        googleapiclient.discovery.build(
+            'compute',
+            'v1',
+            http = FakeHttp(document, args.latency),
+            **build_kwargs,
+        )
+
+    def fetch(url):
+        time.sleep(args.latency)
+        return document
+
+    cache_dir = tempfile.mkdtemp()
+    client.CACHE_DIR = cache_dir
+    client._fetch_document = fetch
+    client.authorized_http = lambda: FakeHttp(document, args.latency)
+
+    def cold():
+        client.clear_cache()
+        shutil.rmtree(cache_dir, ignore_errors = True)
+        client.compute_client()
+
+    def disk():
+        client.clear_cache()
+        client.compute_client()
+
+    try:
+        results = [
+            ('before, discovery.build per call', timeit(before, args.calls)),
+            ('after, cold (fetch + disk write)', timeit(cold, args.calls)),
+            ('after, new process (disk cache)', timeit(disk, args.calls)),
+            (
+                'after, same process',
+                timeit(client.compute_client, args.calls),
+            ),
+        ]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors = True)
+
+    for name, seconds in results:
+        print(f'{name:<40} {seconds * 1000:10.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+Wall time and API calls of `spawn`, `delete` and `build_image` against the
+in-process fake GCE / GCS backend, at different zone inventory sizes. No GCP
+project or network needed.
+
+    python benchmark/control_plane.py --inventory 0 1000 5000
+    python benchmark/control_plane.py --failure-rate 0.05 --output results.jsonl
+"""
+
+import argparse
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ondemand_dask
+from ondemand_dask import fake, function, registry, waiter
+
+PROJECT = 'benchmark'
+ZONE = 'asia-southeast1-a'
+SPAWN = {
+    'image_name': 'dask-build',
+    'project': PROJECT,
+    'zone': ZONE,
+    'cpu': 2,
+    'ram': 4096,
+    'worker_size': 2,
+    # default `post_slack`, delivered to `serve_dashboard`.
+    'webhook': 'http://127.0.0.1:8787/webhook',
+}
+
+
+class Counts(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({'workers': SPAWN['worker_size']}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_dashboard(port = 8787):
+    """
+    answer dask dashboard `/json/counts.json` so readiness checks against the fake IP pass,
+    and slack webhooks.
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Counts)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+
+def measure(name, func, compute, storage, inventory, repeat):
+    times, calls = [], []
+    for i in range(repeat):
+        compute.reset_calls()
+        storage.reset_calls()
+        before = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - before)
+        calls.append(sum(compute.calls.values()) + sum(storage.calls.values()))
+    return {
+        'name': name,
+        'inventory': inventory,
+        'seconds': sum(times) / len(times),
+        'min_seconds': min(times),
+        'api_calls': sum(calls) / len(calls),
+    }
+
+
+def run(inventory, args):
+    compute = fake.FakeCompute(
+        latency = args.latency,
+        scan_latency = args.scan_latency,
+        operation_latency = args.operation_latency,
+        failure_rate = args.failure_rate,
+        seed = args.seed,
+    )
+    storage = fake.FakeStorage(latency = args.latency)
+    results = []
+    with fake.install(compute, storage):
+        compute.add_image(PROJECT, 'dask-build')
+        compute.add_image('ubuntu-os-cloud', 'ubuntu-1804', 'ubuntu-1804-lts')
+        compute.populate(PROJECT, ZONE, inventory)
+
+        def spawn(i, check_exist):
+            ondemand_dask.spawn(
+                cluster_name = f'dask-{inventory}-{check_exist:d}-{i}',
+                check_exist = check_exist,
+                **SPAWN,
+            )
+
+        def exhausted(i, race):
+            # `ZONE` has no capacity, fall back to the next zones of the region.
+            compute.exhaust(ZONE)
+            try:
+                ondemand_dask.spawn(
+                    cluster_name = f'dask-{inventory}-exhausted-{race}-{i}',
+                    check_exist = False,
+                    fallback_zones = [ZONE.rsplit('-', 1)[0]],
+                    race = race,
+                    **SPAWN,
+                )
+            finally:
+                compute.exhaust(ZONE, False)
+
+        def existing(i):
+            ondemand_dask.spawn(
+                cluster_name = f'dask-{inventory}-1-{i}',
+                check_exist = True,
+                **SPAWN,
+            )
+
+        def list_clusters(i, refresh):
+            ondemand_dask.list_clusters(
+                project = PROJECT, zone = ZONE, refresh = refresh
+            )
+
+        def delete(i):
+            ondemand_dask.delete(
+                cluster_name = f'dask-{inventory}-0-{i}',
+                project = PROJECT,
+                zone = ZONE,
+            )
+
+        # local directory stand-in for the GCS wheelhouse, staged through the fake bucket.
+        wheelhouse = tempfile.mkdtemp()
+        open(os.path.join(wheelhouse, 'dask-2.9.0-py3-none-any.whl'), 'wb').close()
+
+        def build_image(i, force):
+            ondemand_dask.build_image(
+                project = PROJECT,
+                zone = ZONE,
+                bucket_name = 'benchmark-bucket',
+                image_name = 'dask-benchmark',
+                family = 'dask-benchmark',
+                webhook = SPAWN['webhook'],
+                validate_webhook = False,
+                force = force,
+                wheelhouse = wheelhouse,
+            )
+
+        benchmarks = [
+            ('spawn', lambda i: spawn(i, False)),
+            ('spawn, check_exist', lambda i: spawn(i, True)),
+            ('spawn, existing', existing),
+            ('spawn, exhausted', lambda i: exhausted(i, 1)),
+            ('spawn, exhausted, race', lambda i: exhausted(i, 3)),
+            ('list_clusters', lambda i: list_clusters(i, True)),
+            ('list_clusters, cached', lambda i: list_clusters(i, False)),
+            ('delete', delete),
+            ('build_image', lambda i: build_image(i, True)),
+            ('build_image, cached', lambda i: build_image(i, False)),
+        ]
+        for name, func in benchmarks:
+            if args.only and name.split(',')[0] not in args.only:
+                continue
+            results.append(
+                measure(name, func, compute, storage, inventory, args.repeat)
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--inventory',
+        type = int,
+        nargs = '+',
+        default = [0, 1000, 5000],
+        help = 'unrelated instances inside the zone',
+    )
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument(
+        '--latency', type = float, default = 0.05, help = 'seconds per API call'
+    )
+    parser.add_argument(
+        '--scan-latency',
+        type = float,
+        default = 0.00002,
+        help = 'extra seconds per zone instance for instances.list',
+    )
+    parser.add_argument(
+        '--operation-latency',
+        type = float,
+        default = 0.5,
+        help = 'seconds for an operation to finish',
+    )
+    parser.add_argument('--failure-rate', type = float, default = 0.0)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument(
+        '--only',
+        nargs = '+',
+        choices = ['spawn', 'list_clusters', 'delete', 'build_image'],
+        help = 'run subset of benchmarks',
+    )
+    parser.add_argument(
+        '--output', help = 'append results as JSON lines, to track over time'
+    )
+    args = parser.parse_args()
+
+    # API calls are rate limited per project, same as real usage.
+    waiter.set_rate_limit(PROJECT, rate = 10.0, burst = 10)
+    # no dask scheduler behind the fake IP, probe the fake dashboard instead.
+    function.dask_connect = None
+    # probe the metadata server once, not inside the first measured spawn.
+    function.caller_network()
+    server = serve_dashboard()
+    registry.PATH = os.path.join(tempfile.mkdtemp(), 'clusters.db')
+    stdout = sys.stdout
+    results = []
+    try:
+        for inventory in args.inventory:
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                results.extend(run(inventory, args))
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(f'{"benchmark":<24} {"inventory":>9} {"seconds":>9} {"min":>9} {"calls":>7}')
+    for r in results:
+        print(
+            f'{r["name"]:<24} {r["inventory"]:>9} {r["seconds"]:>9.3f} '
+            f'{r["min_seconds"]:>9.3f} {r["api_calls"]:>7.1f}'
+        )
+
+    if args.output:
+        record = {
+            'time': time.time(),
+            'version': ondemand_dask.__version__,
+            'params': {
+                k: v for k, v in vars(args).items() if k != 'output'
+            },
+        }
+        with open(args.output, 'a') as fopen:
+            for r in results:
+                fopen.write(json.dumps({**record, **r}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
 from .core import *
 from .upload import *
+from .pool import WarmPool
+from .session import connect
+from .preemption import PreemptionWatcher
+from .job import run_job
+from .telemetry import load_telemetry, recommend_shape
 from .libraries import *
 
 __version__ = '0.0.10'
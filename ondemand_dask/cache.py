@@ -0,0 +1,188 @@
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+
+# only depends on fsspec, also copied into the dask image as a worker preload.
+DIRECTORY = '/scratch/ondemand-dask-cache'
+PROTOCOLS = ('gs', 'gcs')
+
+_lock = threading.Lock()
+stats = {
+    'hits': 0,
+    'misses': 0,
+    'bypass': 0,
+    'hit_bytes': 0,
+    'miss_bytes': 0,
+    'evicted_bytes': 0,
+}
+
+
+def _count(**kwargs):
+    with _lock:
+        for k, v in kwargs.items():
+            stats[k] += v
+
+
+class LRUCache:
+    """
+    node-local whole file cache shared by every worker process on the instance.
+    A file is keyed by path and its generation / etag / mtime, so an overwritten object
+    is never served stale. Least recently read files are evicted after the cache grows
+    above `max_bytes`, files bigger than `max_file_bytes` are read directly.
+
+    parameter
+    ---------
+
+    directory: str
+        local directory for cached files, eg, on the scratch disk.
+    max_bytes: int
+        cache size limit in bytes.
+    max_file_bytes: int, (default=None)
+        files bigger than this are not cached. If None, a quarter of `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes, max_file_bytes = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = (
+            max_bytes // 4 if max_file_bytes is None else max_file_bytes
+        )
+        os.makedirs(directory, exist_ok = True)
+        # updated after every eviction, reading it is free for heartbeat metrics.
+        self.bytes = self.size()
+
+    def key(self, protocol, path, info):
+        version = (
+            info.get('generation')
+            or info.get('etag')
+            or info.get('mtime')
+            or info.get('updated')
+        )
+        raw = f'{protocol}:{path}:{version}:{info.get("size")}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                # readers keep their open handle after unlink.
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            _count(evicted_bytes = size)
+        self.bytes = total
+
+    def fetch(self, fs, path, download):
+        """
+        local path of a cached copy of `path`, None if the file should not be cached.
+        `download(local_path)` writes the remote file to `local_path`.
+        """
+        info = fs.info(path)
+        size = info.get('size') or 0
+        if size > self.max_file_bytes:
+            _count(bypass = 1)
+            return None
+        protocol = fs.protocol if isinstance(fs.protocol, str) else fs.protocol[0]
+        local = os.path.join(self.directory, self.key(protocol, path, info))
+        try:
+            # mtime is the LRU clock, atime is often disabled on scratch mounts.
+            os.utime(local)
+            _count(hits = 1, hit_bytes = size)
+            return local
+        except FileNotFoundError:
+            pass
+
+        temporary = os.path.join(self.directory, f'.{uuid.uuid4().hex}')
+        try:
+            download(temporary)
+            os.replace(temporary, local)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        _count(misses = 1, miss_bytes = size)
+        self.evict()
+        return local
+
+
+def cached(cls, cache):
+    """
+    subclass of fsspec filesystem `cls` reading files through `cache`, other modes and
+    methods are unchanged.
+    """
+
+    class Cached(cls):
+        def _open(self, path, mode = 'rb', **kwargs):
+            if mode != 'rb':
+                return cls._open(self, path, mode = mode, **kwargs)
+
+            def download(local):
+                with cls._open(self, path, mode = 'rb') as src, open(
+                    local, 'wb'
+                ) as dst:
+                    shutil.copyfileobj(src, dst, 4 * 1024 * 1024)
+
+            path = self._strip_protocol(path)
+            local = cache.fetch(self, path, download)
+            if local is None:
+                return cls._open(self, path, mode = mode, **kwargs)
+            from fsspec.implementations.local import LocalFileOpener
+
+            return LocalFileOpener(local, 'rb')
+
+    Cached.__name__ = Cached.__qualname__ = f'Cached{cls.__name__}'
+    Cached.cache = cache
+    return Cached
+
+
+def install(max_bytes, directory = DIRECTORY, protocols = PROTOCOLS):
+    """
+    read `protocols` through a node-local cache inside this process, eg, `dd.read_parquet('gs://...')`.
+    """
+    import fsspec
+
+    cache = LRUCache(directory, max_bytes)
+    for protocol in protocols:
+        try:
+            cls = fsspec.get_filesystem_class(protocol)
+        except ImportError as e:
+            print(f'not caching `{protocol}`, {e}')
+            continue
+        # installed again, wrap the original filesystem only.
+        if hasattr(cls, 'cache'):
+            cls = cls.__bases__[0]
+        fsspec.register_implementation(
+            protocol, cached(cls, cache), clobber = True
+        )
+    return cache
+
+
+def dask_setup(worker):
+    # worker preload, enabled by `spawn(read_cache = ...)`.
+    size = int(os.environ.get('read_cache') or 0)
+    if not size:
+        return
+    cache = install(size * 1024 * 1024)
+    for key in ('hits', 'misses', 'hit_bytes', 'miss_bytes', 'evicted_bytes'):
+        worker.metrics[f'cache_{key}'] = lambda worker, key = key: stats[key]
+    worker.metrics['cache_bytes'] = lambda worker: cache.bytes
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+import google.auth
+import google_auth_httplib2
+import googleapiclient.discovery
+import httplib2
+import requests
+from google.cloud import storage
+
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest'
+CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'ondemand-dask', 'discovery'
+)
+CACHE_TTL = 24 * 60 * 60
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+_lock = threading.RLock()
+_local = threading.local()
+_credentials = None
+_clients = {}
+_http_factory = None
+
+
+def _fetch_document(url):
+    r = requests.get(url, timeout = 30)
+    r.raise_for_status()
+    return r.text
+
+
+def discovery_document(api: str, version: str, ttl: int = CACHE_TTL):
+    """
+    get discovery document, cached on disk for `ttl` seconds.
+    """
+    path = os.path.join(CACHE_DIR, f'{api}-{version}.json')
+    try:
+        if time.time() - os.path.getmtime(path) < ttl:
+            with open(path) as fopen:
+                return fopen.read()
+    except OSError:
+        pass
+
+    document = _fetch_document(
+        DISCOVERY_URL.format(api = api, version = version)
+    )
+    json.loads(document)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok = True)
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(temp, 'w') as fopen:
+            fopen.write(document)
+        os.replace(temp, path)
+    except OSError:
+        pass
+    return document
+
+
+def credentials():
+    """
+    process-wide default credentials.
+    """
+    global _credentials
+
+    with _lock:
+        if _credentials is None:
+            _credentials, _ = google.auth.default(scopes = SCOPES)
+        return _credentials
+
+
+def authorized_http():
+    """
+    authorized http owned by current thread, httplib2 is not thread-safe.
+    The connection is kept alive and reused by next requests in the same thread.
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        if _http_factory is not None:
+            http = _http_factory()
+        else:
+            http = google_auth_httplib2.AuthorizedHttp(
+                credentials(), http = httplib2.Http()
+            )
+        _local.http = http
+    return http
+
+
+def build(api: str, version: str):
+    """
+    process-wide cached googleapiclient resource, safe to share across threads
+    as long as requests executed using `ondemand_dask.waiter.execute`.
+    """
+    key = (api, version)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = googleapiclient.discovery.build_from_document(
+                discovery_document(api, version), http = authorized_http()
+            )
+        return _clients[key]
+
+
+def compute_client():
+    return build('compute', 'v1')
+
+
+def storage_client():
+    with _lock:
+        if 'storage' not in _clients:
+            _clients['storage'] = storage.Client()
+        return _clients['storage']
+
+
+def use(compute = None, storage = None, http = None):
+    """
+    replace process-wide clients, eg, `ondemand_dask.fake` backends for benchmarks.
+    `http` is a callable returning http object for each thread. Reverted by `clear_cache`.
+    """
+    global _http_factory
+
+    with _lock:
+        if compute is not None:
+            _clients[('compute', 'v1')] = compute
+        if storage is not None:
+            _clients['storage'] = storage
+        if http is not None:
+            _http_factory = http
+    _local.__dict__.clear()
+
+
+def clear_cache():
+    """
+    drop in-memory clients and overrides, discovery documents on disk are kept.
+    """
+    global _http_factory
+
+    with _lock:
+        _clients.clear()
+        _http_factory = None
+    _local.__dict__.clear()
@@ -1,9 +1,84 @@
-import googleapiclient.discovery
-import time
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
 from herpetologist import check_type
 from datetime import datetime
-from .function import port_open, post_slack, wait_for_operation
-from typing import Callable
+from .client import compute_client
+from .metrics import Timings
+from . import notify, registry
+from .function import (
+    caller_network,
+    dask_workers_async,
+    execute_async,
+    post_slack,
+    route,
+    run_async,
+    run_coroutine,
+)
+from .waiter import (
+    Backoff,
+    capacity_error,
+    execute,
+    get_instance,
+    wait_for_instance,
+    wait_for_operation,
+)
+from googleapiclient.errors import HttpError
+from typing import Callable, List
+
+CLUSTER_LABEL = 'ondemand-dask-cluster'
+ROLE_LABEL = 'ondemand-dask-role'
+DOCKER_IMAGE = 'ondemand-dask'
+compose_files = {
+    'local': 'docker-compose.yaml',
+    'scheduler': 'docker-compose.yaml',
+    'worker': 'docker-compose.worker.yaml',
+}
+# record boot phases as guest attributes, read by `boot_report`.
+startup_template = """#!/bin/bash
+mark() {{
+    curl -s -X PUT --data "${{2:-$(date +%s.%N)}}" -H 'Metadata-Flavor: Google' \\
+        http://metadata.google.internal/computeMetadata/v1/instance/guest-attributes/ondemand-dask/$1
+}}
+mark startup-script
+if docker image inspect {image} > /dev/null 2>&1; then mark prebaked 1; else mark prebaked 0; fi
+{env}
+{scratch}
+docker-compose -f {compose} up -d
+mark containers-up
+if [ "$role" != "worker" ]; then
+    until curl -sf -o /dev/null http://localhost:8787/health; do sleep 1; done
+fi
+mark dask-ready
+"""
+# local SSDs striped as one scratch volume, mounted into containers as /scratch for dask spill.
+local_ssd_script = """export scratch=/mnt/disks/scratch
+if ! mountpoint -q $scratch; then
+    devices=$(ls /dev/disk/by-id/google-local-*ssd-* | grep -v part)
+    count=$(echo $devices | wc -w)
+    if [ "$count" -gt 1 ]; then
+        mdadm --create /dev/md0 --level=0 --raid-devices=$count $devices --force --run
+        device=/dev/md0
+    else
+        device=$devices
+    fi
+    mkfs.ext4 -F -m 0 $device
+    mkdir -p $scratch
+    mount -o discard,defaults,noatime $device $scratch
+fi
+mark scratch-ready
+"""
+boot_disk_script = """export scratch=/var/lib/ondemand-dask/scratch
+mkdir -p $scratch
+"""
+disk_types = ('pd-standard', 'pd-balanced', 'pd-ssd')
+compressions = ('auto', 'lz4', 'zstd', 'none')
+memory_thresholds_default = {
+    'target': 0.6,
+    'spill': 0.7,
+    'pause': 0.8,
+    'terminate': 0.95,
+}
 
 
 @check_type
@@ -22,16 +97,979 @@ def delete(cluster_name: str, project: str, zone: str):
         compute zone for the cluster.
     """
 
-    compute = googleapiclient.discovery.build('compute', 'v1')
-    operation = (
-        compute.instances()
-        .delete(project = project, zone = zone, instance = cluster_name)
-        .execute()
-    )
-    wait_for_operation(compute, project, zone, operation['name'])
+    compute = compute_client()
+    with Timings('delete', cluster_name) as timings:
+        names = {cluster_name} | {
+            instance['name']
+            for instance in cluster_instances(
+                compute, project, zone, cluster_name
+            )
+        }
+        operations = []
+        for name in sorted(names):
+            try:
+                operations.append(
+                    execute(
+                        compute.instances().delete(
+                            project = project, zone = zone, instance = name
+                        )
+                    )
+                )
+            except HttpError as e:
+                if int(e.resp.status) != 404:
+                    raise
+        timings.lap('delete')
+        for operation in operations:
+            wait_for_operation(compute, project, zone, operation['name'])
+        timings.lap('operation')
+    registry.forget(cluster_name, project, zone)
     return True
 
 
+@check_type
+def boot_report(cluster_name: str, project: str, zone: str):
+    """
+    function to get boot time breakdown of a dask cluster, recorded by the startup script.
+
+    parameter
+    ---------
+
+    cluster_name: str
+        dask cluster name.
+    project: str
+        project id inside gcp.
+    zone: str
+        compute zone for the cluster.
+
+    Returns
+    -------
+    dictionary: {'prebaked': bool, 'vm_boot': seconds, 'containers': seconds, 'dask': seconds, 'total': seconds}
+    """
+
+    compute = compute_client()
+    instance = get_instance(compute, project, zone, cluster_name)
+    if instance is None:
+        raise Exception(f'`{cluster_name}` not found.')
+
+    result = execute(
+        compute.instances().getGuestAttributes(
+            project = project,
+            zone = zone,
+            instance = cluster_name,
+            queryPath = 'ondemand-dask/',
+        )
+    )
+    marks = {
+        item['key']: item['value']
+        for item in result.get('queryValue', {}).get('items', [])
+    }
+    started = instance.get('lastStartTimestamp') or instance.get(
+        'creationTimestamp'
+    )
+    started = datetime.fromisoformat(started).timestamp()
+
+    def elapsed(start, end):
+        if start is None or end is None:
+            return None
+        return round(float(end) - float(start), 3)
+
+    return {
+        'prebaked': marks.get('prebaked') == '1',
+        'vm_boot': elapsed(started, marks.get('startup-script')),
+        'containers': elapsed(
+            marks.get('startup-script'), marks.get('containers-up')
+        ),
+        'dask': elapsed(marks.get('containers-up'), marks.get('dask-ready')),
+        'total': elapsed(started, marks.get('dask-ready')),
+    }
+
+
+@check_type
+def get_cluster(
+    cluster_name: str,
+    project: str,
+    zone: str,
+    refresh: bool = False,
+    ttl: int = registry.TTL,
+):
+    """
+    function to get a dask cluster from local registry, validated by a single instances.get
+    if not cached within `ttl` seconds.
+
+    parameter
+    ---------
+
+    cluster_name: str
+        dask cluster name.
+    project: str
+        project id inside gcp.
+    zone: str
+        compute zone for the cluster.
+    refresh: bool, (default=False)
+        if True, will skip the registry and get the instance.
+    ttl: int, (default=300)
+        seconds a registry entry is trusted.
+
+    Returns
+    -------
+    dictionary: {'cluster_name', 'project', 'zone', 'ip', 'internal_ip', 'status', 'shape', 'updated'}, None if not exist.
+    """
+
+    if not refresh:
+        entry = registry.lookup(cluster_name, project, zone, ttl = ttl)
+        if entry:
+            return entry
+
+    instance = get_instance(compute_client(), project, zone, cluster_name)
+    if instance is None:
+        registry.forget(cluster_name, project, zone)
+        return None
+
+    entry = _cluster_entry(instance)
+    registry.record(project = project, zone = zone, **entry)
+    return registry.lookup(cluster_name, project, zone, ttl = ttl) or dict(
+        entry, project = project, zone = zone, updated = None
+    )
+
+
+@check_type
+def list_clusters(
+    project: str, zone: str, refresh: bool = False, ttl: int = registry.TTL
+):
+    """
+    function to list dask clusters inside a zone, from local registry if listed within `ttl` seconds.
+
+    parameter
+    ---------
+
+    project: str
+        project id inside gcp.
+    zone: str
+        compute zone for the clusters.
+    refresh: bool, (default=False)
+        if True, will list labelled instances and replace the registry.
+    ttl: int, (default=300)
+        seconds a zone listing is trusted.
+
+    Returns
+    -------
+    list: [{'cluster_name', 'project', 'zone', 'ip', 'internal_ip', 'status', 'shape', 'updated'}]
+    """
+
+    if not refresh:
+        entries = registry.entries(project, zone, ttl = ttl)
+        if entries is not None:
+            return entries
+
+    compute = compute_client()
+    request = compute.instances().list(
+        project = project, zone = zone, filter = f'labels.{CLUSTER_LABEL}:*'
+    )
+    clusters = []
+    while request is not None:
+        result = execute(request)
+        for instance in result.get('items', []):
+            # workers carry the cluster label too, only keep the scheduler.
+            if instance['labels'][CLUSTER_LABEL] == instance['name']:
+                clusters.append(_cluster_entry(instance))
+        request = compute.instances().list_next(request, result)
+
+    registry.replace(project, zone, clusters)
+    entries = registry.entries(project, zone, ttl = ttl)
+    if entries is None:
+        entries = [
+            dict(c, project = project, zone = zone, updated = None)
+            for c in clusters
+        ]
+    return entries
+
+
+def _cluster_entry(instance):
+    ip_address, internal_ip = _get_ip(instance)
+    shape = {}
+    found = re.search(r'custom-(\d+)-(\d+)', instance.get('machineType', ''))
+    if found:
+        shape['cpu'], shape['ram'] = int(found.group(1)), int(found.group(2))
+    for item in instance.get('metadata', {}).get('items', []):
+        if item['key'] == 'startup-script':
+            found = re.search(
+                r'^export worker_size=(\d+)$', item['value'], re.M
+            )
+            if found:
+                shape['worker_size'] = int(found.group(1))
+    return {
+        'cluster_name': instance['name'],
+        'ip': ip_address,
+        'internal_ip': internal_ip,
+        'status': instance.get('status'),
+        'shape': shape,
+    }
+
+
+def cluster_instances(compute, project: str, zone: str, cluster_name: str):
+    """
+    list all instances belong to a logical cluster, scheduler and workers.
+    """
+    request = compute.instances().list(
+        project = project,
+        zone = zone,
+        filter = f'labels.{CLUSTER_LABEL} = "{cluster_name}"',
+    )
+    instances = []
+    while request is not None:
+        result = execute(request)
+        instances.extend(result.get('items', []))
+        request = compute.instances().list_next(request, result)
+    return instances
+
+
+@check_type
+def worker_resources(
+    cpu: int,
+    ram: int,
+    worker_size: int,
+    threads_per_worker: int = 0,
+    memory_limit: int = 0,
+    nthreads: int = 0,
+    memory_thresholds = None,
+):
+    """
+    derive dask worker resources from the machine shape, 0 means auto.
+
+    parameter
+    ---------
+
+    cpu: int
+        cpu core count.
+    ram: int
+        ram size in term of MB.
+    worker_size: int
+        worker processes per instance.
+    threads_per_worker: int, (default=0)
+        if 0, will split `nthreads` evenly across worker processes, minimum 1, so
+        `worker_size` bigger than `nthreads` oversubscribes, printed as a warning.
+    memory_limit: int, (default=0)
+        memory limit (MB) per worker process. If 0, will split `ram` after reserved memory
+        for OS, docker and scheduler, 10% of `ram` between 512 MB and 2048 MB.
+    nthreads: int, (default=0)
+        total threads for all worker processes inside an instance. If 0, will use `cpu`.
+    memory_thresholds: dict, (default=None)
+        fractions of `memory_limit`, keys are `target`, `spill`, `pause` and `terminate`.
+        False to disable. Default is {'target': 0.6, 'spill': 0.7, 'pause': 0.8, 'terminate': 0.95}.
+
+    Returns
+    -------
+    dictionary: {'threads_per_worker', 'memory_limit', 'memory_target', 'memory_spill', 'memory_pause', 'memory_terminate'}
+    """
+
+    if min(threads_per_worker, memory_limit, nthreads) < 0:
+        raise Exception(
+            '`threads_per_worker`, `memory_limit` and `nthreads` must be bigger or equal than 0'
+        )
+
+    thresholds = dict(memory_thresholds_default)
+    thresholds.update(memory_thresholds or {})
+    unknown = set(thresholds) - set(memory_thresholds_default)
+    if unknown:
+        raise Exception(
+            f'`memory_thresholds` only accept {sorted(memory_thresholds_default)}, got {sorted(unknown)}'
+        )
+    enabled = [v for v in thresholds.values() if v is not False]
+    if any(not 0 < v <= 1 for v in enabled):
+        raise Exception('`memory_thresholds` must be between 0 and 1, or False.')
+
+    if not threads_per_worker:
+        threads_per_worker = max(1, (nthreads or cpu) // worker_size)
+    if worker_size * threads_per_worker > (nthreads or cpu):
+        print(
+            f'{worker_size} workers with {threads_per_worker} threads each oversubscribe '
+            f'{nthreads or cpu} threads, lower `worker_size` or `threads_per_worker`.'
+        )
+
+    if not memory_limit:
+        reserved = min(max(ram // 10, 512), 2048)
+        memory_limit = max(ram - reserved, 256) // worker_size
+    if memory_limit * worker_size > ram:
+        raise Exception('`memory_limit` * `worker_size` must be less or equal than `ram`')
+
+    resources = {
+        'threads_per_worker': threads_per_worker,
+        'memory_limit': memory_limit,
+    }
+    for key, value in thresholds.items():
+        resources[f'memory_{key}'] = (
+            'false' if value is False else value
+        )
+    return resources
+
+
+def _webhook(webhook_function, **kwargs):
+    if webhook_function.__name__ == 'post_slack':
+
+        def nested_post(msg):
+            return webhook_function(msg, **kwargs)
+
+    else:
+
+        def nested_post(msg):
+            return webhook_function(msg)
+
+    return nested_post
+
+
+def _get_ip(instance):
+    ip_address = instance['networkInterfaces'][0]['accessConfigs'][0].get(
+        'natIP'
+    )
+    internal_ip = instance['networkInterfaces'][0].get('networkIP')
+    return ip_address, internal_ip
+
+
+def _startup_script(
+    cluster_name,
+    project,
+    zone,
+    worker_size,
+    graceful_delete,
+    role = 'local',
+    scheduler = '',
+    options = None,
+    local_ssd = 0,
+):
+    env = {
+        'worker_size': worker_size,
+        'name': cluster_name,
+        'project': project,
+        'zone': zone,
+        'expired': graceful_delete,
+        'role': role,
+        'scheduler': scheduler,
+        **(options or {}),
+    }
+    env = '\n'.join(f'export {k}={v}' for k, v in env.items())
+    return startup_template.format(
+        image = DOCKER_IMAGE,
+        env = env,
+        scratch = (local_ssd_script if local_ssd else boot_disk_script).strip(),
+        compose = compose_files[role],
+    )
+
+
+def _instance_config(
+    cluster_name,
+    source_disk_image,
+    project,
+    zone,
+    cpu,
+    ram,
+    worker_size,
+    disk_size,
+    preemptible,
+    graceful_delete,
+    startup_script = None,
+    labels = None,
+    role = 'local',
+    scheduler = '',
+    name = None,
+    options = None,
+    disk_type = 'pd-standard',
+    local_ssd = 0,
+):
+    machine_type = f'zones/{zone}/machineTypes/custom-{cpu}-{ram}-ext'
+
+    if startup_script is None:
+        startup_script = _startup_script(
+            cluster_name = cluster_name,
+            project = project,
+            zone = zone,
+            worker_size = worker_size,
+            graceful_delete = graceful_delete,
+            role = role,
+            scheduler = scheduler,
+            options = options,
+            local_ssd = local_ssd,
+        )
+
+    config = {
+        'name': name or cluster_name,
+        'tags': {'items': ['dask']},
+        'machineType': machine_type,
+        'disks': [
+            {
+                'boot': True,
+                'autoDelete': True,
+                'diskSizeGb': disk_size,
+                'initializeParams': {
+                    'sourceImage': source_disk_image,
+                    'diskType': f'zones/{zone}/diskTypes/{disk_type}',
+                },
+            }
+        ]
+        + [
+            {
+                'type': 'SCRATCH',
+                'autoDelete': True,
+                'interface': 'NVME',
+                'initializeParams': {
+                    'diskType': f'zones/{zone}/diskTypes/local-ssd'
+                },
+            }
+            for _ in range(local_ssd)
+        ],
+        'networkInterfaces': [
+            {
+                'network': 'global/networks/default',
+                'accessConfigs': [
+                    {'type': 'ONE_TO_ONE_NAT', 'name': 'External NAT'}
+                ],
+            }
+        ],
+        'serviceAccounts': [
+            {
+                'email': 'default',
+                'scopes': [
+                    'https://www.googleapis.com/auth/devstorage.read_write',
+                    'https://www.googleapis.com/auth/logging.write',
+                    'https://www.googleapis.com/auth/compute',
+                ],
+            }
+        ],
+        'metadata': {
+            'items': [
+                {'key': 'startup-script', 'value': startup_script},
+                {'key': 'enable-guest-attributes', 'value': 'TRUE'},
+            ]
+        },
+    }
+
+    if preemptible:
+        config['scheduling'] = {'preemptible': True}
+    if labels:
+        config['labels'] = labels
+
+    return config
+
+
+def _is_region(location):
+    return re.fullmatch(r'[a-z]+-[a-z]+\d+', location) is not None
+
+
+async def _candidate_zones(compute, project, zone, fallback_zones):
+    """
+    ordered zones to spawn, regions expanded to their zones.
+    """
+    zones = []
+    for location in [zone] + list(fallback_zones):
+        if _is_region(location):
+            region = await execute_async(
+                compute.regions().get(project = project, region = location)
+            )
+            found = sorted(z.rsplit('/', 1)[-1] for z in region['zones'])
+        else:
+            found = [location]
+        for candidate in found:
+            if candidate not in zones:
+                zones.append(candidate)
+    return zones
+
+
+async def _gather_all(*coros):
+    """
+    like `asyncio.gather`, but wait every coroutine done before raise the first exception,
+    so nothing is still inserting while we clean up.
+    """
+    results = await asyncio.gather(*coros, return_exceptions = True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def _wait_ready(ip_address, timeout = None, workers = 0):
+    backoff = Backoff(initial = 0.25, maximum = 2.0, timeout = timeout)
+    while True:
+        remaining = backoff.remaining()
+        registered = await dask_workers_async(
+            ip_address,
+            timeout = 5 if remaining is None else min(max(remaining, 0.1), 5),
+        )
+        if registered is not None and registered >= workers:
+            return registered
+        await asyncio.sleep(backoff.next())
+
+
+async def _spawn_async(
+    cluster_name: str,
+    image_name: str,
+    project: str,
+    zone: str,
+    cpu: int,
+    ram: int,
+    worker_size: int,
+    disk_size: int = 10,
+    check_exist: bool = True,
+    preemptible: bool = False,
+    graceful_delete: int = 180,
+    webhook_function: Callable = post_slack,
+    timeout: int = 900,
+    pool = None,
+    workers: int = 0,
+    adaptive: bool = False,
+    minimum_workers: int = 1,
+    threads_per_worker: int = 0,
+    memory_limit: int = 0,
+    nthreads: int = 0,
+    memory_thresholds = None,
+    disk_type: str = 'pd-standard',
+    local_ssd: int = 0,
+    ready_workers: int = 1,
+    fallback_zones: List[str] = [],
+    race: int = 1,
+    telemetry_bucket = None,
+    telemetry_interval: int = 10,
+    read_cache: int = 0,
+    internal = None,
+    compression: str = 'auto',
+    compute = None,
+    **kwargs,
+):
+    """
+    asynchronous version of `spawn`, api calls run on executor threads and polling
+    use asyncio.sleep, so multiple clusters can spawn concurrently on the same event loop.
+
+    parameter
+    ---------
+
+    pool: ondemand_dask.WarmPool, (default=None)
+        if not None, will resume a warm instance from the pool before spawn a new instance.
+        `disk_size`, `disk_type` and `preemptible` must be same as the pool.
+    compute: googleapiclient.discovery.Resource, (default=None)
+        compute client to reuse. If None, will use process-wide cached compute client.
+
+    Other parameters are same as `spawn`.
+
+    Returns
+    -------
+    dictionary: {'ip': ip_address, 'internal_ip': internal_ip, 'zone': zone, 'address': scheduler_address, 'timings': {'phases', 'total', 'api_calls', 'retries'}}
+    """
+
+    if cpu < 1:
+        raise Exception('cpu must be bigger than 0')
+    if ram % 256 != 0:
+        raise Exception('ram must be divisible by 256')
+    if worker_size < 1:
+        raise Exception('worker_size must be bigger than 0')
+    if workers < 0:
+        raise Exception('workers must be bigger or equal than 0')
+    if workers and pool is not None:
+        raise Exception(
+            '`pool` only support single node cluster, `workers` must be 0.'
+        )
+    if disk_type not in disk_types:
+        raise Exception(f'`disk_type` must be one of {disk_types}')
+    if compression not in compressions:
+        raise Exception(f'`compression` must be one of {compressions}')
+    if local_ssd < 0:
+        raise Exception('local_ssd must be bigger or equal than 0')
+    if local_ssd and pool is not None:
+        raise Exception(
+            '`pool` instances are stopped while warm, not support `local_ssd`.'
+        )
+    if pool is not None and (disk_size, disk_type, preemptible) != (
+        pool.disk_size,
+        pool.disk_type,
+        pool.preemptible,
+    ):
+        raise Exception(
+            '`disk_size`, `disk_type` and `preemptible` must be same as `pool`, '
+            f'{pool.disk_size}, {pool.disk_type} and {pool.preemptible}.'
+        )
+    if adaptive and not 0 <= minimum_workers <= (workers or worker_size):
+        raise Exception(
+            '`minimum_workers` must be between 0 and `workers`, '
+            'or `worker_size` for single node cluster.'
+        )
+
+    resources = worker_resources(
+        cpu = cpu,
+        ram = ram,
+        worker_size = worker_size,
+        threads_per_worker = threads_per_worker,
+        memory_limit = memory_limit,
+        nthreads = nthreads,
+        memory_thresholds = memory_thresholds,
+    )
+    if ready_workers < 0:
+        raise Exception('ready_workers must be bigger or equal than 0')
+    if race < 1:
+        raise Exception('race must be bigger than 0')
+    # adaptive cluster may scale down to `minimum_workers` before any worker joins.
+    if adaptive:
+        expected = minimum_workers * (worker_size if workers else 1)
+    else:
+        expected = worker_size * max(workers, 1)
+    ready_workers = min(ready_workers, expected)
+
+    if telemetry_interval < 1:
+        raise Exception('telemetry_interval must be bigger than 0')
+    # cache shares the scratch volume with dask spill.
+    scratch_size = (local_ssd * 375 if local_ssd else disk_size) * 1024
+    if not 0 <= read_cache <= scratch_size // 2:
+        raise Exception(
+            f'read_cache must be between 0 and {scratch_size // 2} MB, half of the scratch disk.'
+        )
+
+    options = {
+        'adaptive': int(adaptive),
+        'minimum': minimum_workers,
+        'cpu': cpu,
+        'ram': ram,
+        'workers': workers,
+        'telemetry_bucket': telemetry_bucket or '',
+        'telemetry_interval': telemetry_interval,
+        'read_cache': read_cache,
+        'compression': compression,
+        **resources,
+    }
+
+    with Timings('spawn', cluster_name) as timings:
+        nested_post = _webhook(webhook_function, **kwargs)
+
+        if compute is None:
+            compute = compute_client()
+        ip_address, internal_ip = None, None
+        existing_shape = None
+        # metadata server only answers on GCE, probe it while listing zones.
+        zones, network = await asyncio.gather(
+            _candidate_zones(compute, project, zone, fallback_zones),
+            run_async(caller_network),
+        )
+        if internal is None:
+            internal = network == (project, 'default')
+
+        if check_exist:
+
+            async def existing(candidate):
+                entry = await run_async(
+                    registry.lookup, cluster_name, project, candidate
+                )
+                # trust a cached cluster only if the scheduler still answers, no api call needed.
+                if (
+                    entry
+                    and entry['ip']
+                    and await dask_workers_async(
+                        route(entry['ip'], entry['internal_ip'], project, internal),
+                        timeout = 2,
+                    )
+                    is not None
+                ):
+                    return entry['ip'], entry['internal_ip'], {}
+                instance = await run_async(
+                    get_instance, compute, project, candidate, cluster_name
+                )
+                if instance is None:
+                    return None, None, {}
+                entry = _cluster_entry(instance)
+                return entry['ip'], entry['internal_ip'], entry['shape']
+
+            found = await asyncio.gather(*[existing(c) for c in zones])
+            for candidate, (ip_address, internal_ip, shape) in zip(zones, found):
+                if ip_address:
+                    # record the running instance shape, not the requested one.
+                    existing_shape = shape
+                    zone = candidate
+                    print(ip_address, internal_ip, 'done.')
+                    break
+            timings.lap('check_exist')
+
+        backoff = Backoff(timeout = timeout)
+
+        if not ip_address and pool is not None:
+            if pool.project != project or pool.zone not in zones:
+                raise Exception(
+                    '`pool` must be in the same project and zone.'
+                )
+            zone = pool.zone
+
+            print(f'Acquiring warm instance for `{cluster_name}` from pool.')
+            instance = await run_async(
+                pool.acquire,
+                cluster_name = cluster_name,
+                cpu = cpu,
+                ram = ram,
+                worker_size = worker_size,
+                graceful_delete = graceful_delete,
+                timeout = backoff.remaining(),
+                options = options,
+            )
+            timings.lap('pool')
+            if instance:
+                ip_address, internal_ip = _get_ip(instance)
+                print(ip_address, internal_ip, 'done.')
+
+                print(f'Waiting Dask cluster `{cluster_name}` to run.')
+                await _wait_ready(
+                    route(ip_address, internal_ip, project, internal),
+                    timeout = backoff.remaining(),
+                    workers = ready_workers,
+                )
+                timings.lap('ready')
+                print('Done.')
+            else:
+                print('Pool is empty, spawning a new instance.')
+
+        if not ip_address:
+
+            image_response = await execute_async(
+                compute.images().get(project = project, image = image_name)
+            )
+
+            role = 'scheduler' if workers else 'local'
+            names = [cluster_name] + [
+                f'{cluster_name}-worker-{i}' for i in range(workers)
+            ]
+
+            async def insert(candidate):
+                # workers resolve the scheduler using GCE internal DNS,
+                # so every instance can insert together.
+                scheduler = f'{cluster_name}.{candidate}.c.{project}.internal'
+                configs = [
+                    _instance_config(
+                        cluster_name = cluster_name,
+                        source_disk_image = image_response['selfLink'],
+                        project = project,
+                        zone = candidate,
+                        cpu = cpu,
+                        ram = ram,
+                        worker_size = worker_size,
+                        disk_size = disk_size,
+                        preemptible = preemptible,
+                        graceful_delete = graceful_delete,
+                        labels = {
+                            CLUSTER_LABEL: cluster_name,
+                            ROLE_LABEL: role if no == 0 else 'worker',
+                        },
+                        role = role if no == 0 else 'worker',
+                        scheduler = scheduler,
+                        name = name,
+                        options = options,
+                        disk_type = disk_type,
+                        local_ssd = local_ssd,
+                    )
+                    for no, name in enumerate(names)
+                ]
+                return await _gather_all(
+                    *[
+                        execute_async(
+                            compute.instances().insert(
+                                project = project, zone = candidate, body = config
+                            )
+                        )
+                        for config in configs
+                    ]
+                )
+
+            async def operate(candidate, operations):
+                return await _gather_all(
+                    *[
+                        run_async(
+                            wait_for_operation,
+                            compute,
+                            project,
+                            candidate,
+                            operation['name'],
+                            timeout = backoff.remaining(),
+                        )
+                        for operation in operations
+                    ]
+                )
+
+            async def cleanup(candidate, task = None):
+                if task is not None:
+                    await asyncio.gather(task, return_exceptions = True)
+                instances = await run_async(
+                    cluster_instances, compute, project, candidate, cluster_name
+                )
+                # GCE finishes deletes on its own, no need to wait the operations.
+                await asyncio.gather(
+                    *[
+                        execute_async(
+                            compute.instances().delete(
+                                project = project,
+                                zone = candidate,
+                                instance = instance['name'],
+                            )
+                        )
+                        for instance in instances
+                    ],
+                    return_exceptions = True,
+                )
+
+            winner, cleanups = None, []
+            for i in range(0, len(zones), race):
+                batch = zones[i:i + race]
+                print(f'Inserting `{cluster_name}` in {", ".join(batch)}.')
+                inserted = await asyncio.gather(
+                    *[insert(c) for c in batch], return_exceptions = True
+                )
+                timings.lap('insert')
+
+                failed, losers, tasks = [], [], {}
+                for candidate, operations in zip(batch, inserted):
+                    if isinstance(operations, BaseException):
+                        failed.append((candidate, operations))
+                    else:
+                        task = asyncio.ensure_future(
+                            operate(candidate, operations)
+                        )
+                        tasks[task] = candidate
+
+                print(f'Waiting instance `{cluster_name}` to run.')
+                while tasks and winner is None:
+                    done, _ = await asyncio.wait(
+                        tasks, return_when = asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        candidate = tasks.pop(task)
+                        if task.exception() is not None:
+                            failed.append((candidate, task.exception()))
+                        elif winner is None:
+                            winner = candidate
+                        else:
+                            # finished in the same round as the winner.
+                            losers.append(candidate)
+                timings.lap('operation')
+
+                # delete partial clusters and losers of the race in background while
+                # the winner boots, losers still running are deleted after their inserts done.
+                cleanups.extend(
+                    asyncio.ensure_future(cleanup(candidate))
+                    for candidate in [c for c, _ in failed] + losers
+                )
+                cleanups.extend(
+                    asyncio.ensure_future(cleanup(candidate, task))
+                    for task, candidate in tasks.items()
+                )
+                for candidate, e in failed:
+                    if capacity_error(e):
+                        print(f'`{candidate}` has no capacity, {e}')
+                    elif winner:
+                        # another zone already won, keep it.
+                        print(f'failed to spawn in `{candidate}`, {e}')
+                    else:
+                        await asyncio.gather(*cleanups, return_exceptions = True)
+                        raise e
+
+                if winner:
+                    break
+
+            if winner is None:
+                await asyncio.gather(*cleanups, return_exceptions = True)
+                raise Exception(
+                    f'no capacity for `custom-{cpu}-{ram}-ext` in {", ".join(zones)}.'
+                )
+            zone = winner
+            print('Done.')
+
+            try:
+
+                instance = await run_async(
+                    wait_for_instance,
+                    compute,
+                    project,
+                    zone,
+                    cluster_name,
+                    timeout = backoff.remaining(),
+                )
+                timings.lap('ip')
+                ip_address, internal_ip = _get_ip(instance)
+                print(ip_address, internal_ip, 'done.')
+
+                print(f'Waiting Dask cluster `{cluster_name}` to run.')
+                await _wait_ready(
+                    route(ip_address, internal_ip, project, internal),
+                    timeout = backoff.remaining(),
+                    workers = ready_workers,
+                )
+                timings.lap('ready')
+                print('Done.')
+            finally:
+                await asyncio.gather(*cleanups, return_exceptions = True)
+
+        slack_msg = """
+            Spawned Dask cluster. 
+            *Time spawn*: {exec_date}
+            *Dask cluster name*: {dask_name}
+            *CPU Core*: {cpu}
+            *RAM (MB)*: {ram}
+            *Worker count*: {worker_size}
+            *Threads per worker*: {threads_per_worker}
+            *Memory per worker (MB)*: {memory_limit}
+            *Worker VM count*: {workers}
+            *Zone*: {zone}
+            *Dask Dasboard Url*: http://{dask_ip}:8787
+            """.format(
+            exec_date = str(datetime.now()),
+            dask_name = cluster_name,
+            dask_ip = ip_address,
+            cpu = cpu,
+            ram = ram,
+            worker_size = worker_size,
+            threads_per_worker = resources['threads_per_worker'],
+            memory_limit = resources['memory_limit'],
+            workers = workers,
+            zone = zone,
+        )
+        # delivered on background thread, coalesced with other clusters spawned together.
+        notify.dispatcher().send(
+            nested_post,
+            slack_msg,
+            key = (webhook_function, repr(sorted(kwargs.items()))),
+        )
+        timings.lap('webhook')
+
+        shape = existing_shape
+        if shape is None:
+            shape = {
+                'cpu': cpu,
+                'ram': ram,
+                'worker_size': worker_size,
+                'workers': workers,
+                'adaptive': adaptive,
+                'disk_type': disk_type,
+                'local_ssd': local_ssd,
+                'telemetry_bucket': telemetry_bucket,
+                'read_cache': read_cache,
+                'compression': compression,
+                **resources,
+            }
+        await run_async(
+            registry.record,
+            cluster_name = cluster_name,
+            project = project,
+            zone = zone,
+            ip = ip_address,
+            internal_ip = internal_ip,
+            shape = shape,
+        )
+
+        host = route(ip_address, internal_ip, project, internal)
+        result = {
+            'ip': ip_address,
+            'internal_ip': internal_ip,
+            'zone': zone,
+            'address': f'tcp://{host}:8786',
+        }
+
+    result['timings'] = timings.result()
+    return result
+
+
+# herpetologist can not check `typing.Callable` on newer python, `spawn`, `spawn_many`
+# and other internal callers check arguments once and call `_spawn_async` directly.
+spawn_async = check_type(_spawn_async)
+
+
 @check_type
 def spawn(
     cluster_name: str,
@@ -46,6 +1084,25 @@ def spawn(
     preemptible: bool = False,
     graceful_delete: int = 180,
     webhook_function: Callable = post_slack,
+    timeout: int = 900,
+    pool = None,
+    workers: int = 0,
+    adaptive: bool = False,
+    minimum_workers: int = 1,
+    threads_per_worker: int = 0,
+    memory_limit: int = 0,
+    nthreads: int = 0,
+    memory_thresholds = None,
+    disk_type: str = 'pd-standard',
+    local_ssd: int = 0,
+    ready_workers: int = 1,
+    fallback_zones: List[str] = [],
+    race: int = 1,
+    telemetry_bucket = None,
+    telemetry_interval: int = 10,
+    read_cache: int = 0,
+    internal = None,
+    compression: str = 'auto',
     **kwargs,
 ):
     """
@@ -61,13 +1118,14 @@ def spawn(
     project: str
         project id inside gcp.
     zone: str
-        compute zone for the cluster.
+        compute zone for the cluster, or a region to use any zone inside the region.
     cpu: int
         cpu core count.
     ram: int
         ram size in term of MB.
     worker_size: int
-        worker size of dask cluster, good value should be worker size = 2 * cpu core.
+        worker size of dask cluster, keep `worker_size` <= `cpu`, tune `threads_per_worker`
+        for more threads per process.
     disk_size: int, (default=10)
         Disk size (GB) for the dask cluster.
     check_exist: bool, (default=True)
@@ -77,172 +1135,153 @@ def spawn(
         Read more, https://cloud.google.com/compute/docs/instances/preemptible
     graceful_delete: int, (default=180)
         Dask will automatically delete itself if no process after graceful_delete (seconds).
+        A connected client keeps the cluster alive, close it to let the cluster delete itself.
     webhook_function: Callable, (default=post_slack)
         Callable function to send alert, default is post_slack.
+    timeout: int, (default=900)
+        maximum seconds to wait the cluster ready, raise TimeoutError after that.
+    pool: ondemand_dask.WarmPool, (default=None)
+        if not None, will resume a warm instance from the pool before spawn a new instance,
+        spawn latency drop from minutes to seconds. `disk_size`, `disk_type` and `preemptible`
+        must be same as the pool.
+    workers: int, (default=0)
+        if bigger than 0, will spawn a scheduler instance and `workers` worker instances,
+        every instance use `cpu` and `ram`, each worker instance run `worker_size` workers.
+        All instances labelled as one cluster and deleted together.
+    adaptive: bool, (default=False)
+        if True, will scale workers based on task backlog and memory pressure.
+        Single node cluster scale worker processes between `minimum_workers` and `worker_size`,
+        multi-node cluster start and stop worker instances between `minimum_workers` and `workers`.
+    minimum_workers: int, (default=1)
+        minimum worker processes, or worker instances for multi-node cluster, if `adaptive`.
+    threads_per_worker: int, (default=0)
+        threads per worker process. If 0, will split `nthreads` evenly across `worker_size`, minimum 1.
+    memory_limit: int, (default=0)
+        memory limit (MB) per worker process. If 0, will split `ram` evenly across `worker_size`
+        after reserved memory for OS, docker and scheduler.
+    nthreads: int, (default=0)
+        total threads for all worker processes inside an instance. If 0, will use `cpu`.
+    memory_thresholds: dict, (default=None)
+        fractions of `memory_limit` for dask to spill to disk, pause and restart a worker,
+        eg, {'target': 0.6, 'spill': 0.7, 'pause': 0.8, 'terminate': 0.95}. False to disable.
+    disk_type: str, (default='pd-standard')
+        boot disk type, one of 'pd-standard', 'pd-balanced' and 'pd-ssd'.
+    local_ssd: int, (default=0)
+        count of 375 GB local NVMe SSDs to attach, striped and used as dask spill directory.
+        If 0, dask spill to the boot disk. Not support `pool`.
+    ready_workers: int, (default=1)
+        wait until at least `ready_workers` dask workers registered to the scheduler before return,
+        capped by expected workers. If 0, only wait the scheduler to accept connections.
+    fallback_zones: List[str], (default=[])
+        zones or regions to try in order after `zone` if the zone has no capacity
+        for the shape, eg, ZONE_RESOURCE_POOL_EXHAUSTED.
+    race: int, (default=1)
+        zones to insert at the same time, the first cluster running is kept and the others
+        deleted. Faster during capacity shortage, but pay a few seconds of extra instances.
+    telemetry_bucket: str, (default=None)
+        if not None, the cluster samples worker cpu, memory, spill and task throughput every
+        `telemetry_interval` seconds and writes them to
+        `gs://{telemetry_bucket}/ondemand-dask-telemetry/{cluster_name}/` on shutdown,
+        read by `ondemand_dask.recommend_shape`.
+    telemetry_interval: int, (default=10)
+        seconds between telemetry samples.
+    read_cache: int, (default=0)
+        size (MB) of node-local cache on the scratch disk for `gs://` files read by workers
+        through fsspec / gcsfs, least recently read files evicted. If 0, no cache.
+        Must be less than half of `local_ssd` or `disk_size`.
+    internal: bool, (default=None)
+        if True, reach the scheduler using internal IP, returned as `address`. If None, use
+        internal IP if this machine runs inside the same project and VPC network.
+    compression: str, (default='auto')
+        dask comm compression inside the cluster, one of 'auto', 'lz4', 'zstd' and 'none'.
+        'auto' use lz4, installed in the image.
     **kwargs:
         Keyword arguments to pass to webhook_function.
 
     Returns
     -------
-    dictionary: {'ip': ip_address, 'internal_ip': internal_ip}
+    dictionary: {'ip': ip_address, 'internal_ip': internal_ip, 'zone': zone, 'address': scheduler_address, 'timings': {'phases', 'total', 'api_calls', 'retries'}}
     """
 
-    if cpu < 1:
-        raise Exception('cpu must be bigger than 0')
-    if ram % 256 != 0:
-        raise Exception('ram must be divisible by 256')
-    if worker_size < 1:
-        raise Exception('worker_size must be bigger than 0')
-
-    if webhook_function.__name__ == 'post_slack':
-
-        def nested_post(msg):
-            return webhook_function(msg, **kwargs)
+    return run_coroutine(
+        _spawn_async(
+            cluster_name = cluster_name,
+            image_name = image_name,
+            project = project,
+            zone = zone,
+            cpu = cpu,
+            ram = ram,
+            worker_size = worker_size,
+            disk_size = disk_size,
+            check_exist = check_exist,
+            preemptible = preemptible,
+            graceful_delete = graceful_delete,
+            webhook_function = webhook_function,
+            timeout = timeout,
+            pool = pool,
+            workers = workers,
+            adaptive = adaptive,
+            minimum_workers = minimum_workers,
+            threads_per_worker = threads_per_worker,
+            memory_limit = memory_limit,
+            nthreads = nthreads,
+            memory_thresholds = memory_thresholds,
+            disk_type = disk_type,
+            local_ssd = local_ssd,
+            ready_workers = ready_workers,
+            fallback_zones = fallback_zones,
+            race = race,
+            telemetry_bucket = telemetry_bucket,
+            telemetry_interval = telemetry_interval,
+            read_cache = read_cache,
+            internal = internal,
+            compression = compression,
+            **kwargs,
+        )
+    )
 
-    else:
 
-        def nested_post(msg):
-            return webhook_function(msg)
+@check_type
+def spawn_many(specs: List[dict], **kwargs):
+    """
+    function to spawn multiple dask clusters concurrently, share one compute client.
 
-    compute = googleapiclient.discovery.build('compute', 'v1')
-    ip_address, internal_ip = None, None
+    parameter
+    ---------
 
-    if check_exist:
-        result = (
-            compute.instances().list(project = project, zone = zone).execute()
-        )
-        results = result['items'] if 'items' in result else None
-        dask = [r for r in results if r['name'] == cluster_name]
-        if len(dask) > 0:
-            dask = dask[0]
-            ip_address = dask['networkInterfaces'][0]['accessConfigs'][0][
-                'natIP'
-            ]
-            internal_ip = dask['networkInterfaces'][0]['networkIP']
-            print(ip_address, internal_ip, 'done.')
-
-    if not ip_address:
-
-        image_response = (
-            compute.images()
-            .get(project = project, image = image_name)
-            .execute()
-        )
-
-        source_disk_image = image_response['selfLink']
-        machine_type = f'zones/{zone}/machineTypes/custom-{cpu}-{ram}-ext'
-
-        startup_script = f'worker_size={worker_size} name={cluster_name} project={project} zone={zone} expired={graceful_delete} docker-compose -f docker-compose.yaml up --build'
-
-        config = {
-            'name': cluster_name,
-            'tags': {'items': ['dask']},
-            'machineType': machine_type,
-            'disks': [
-                {
-                    'boot': True,
-                    'autoDelete': True,
-                    'diskSizeGb': disk_size,
-                    'initializeParams': {'sourceImage': source_disk_image},
-                }
-            ],
-            'networkInterfaces': [
-                {
-                    'network': 'global/networks/default',
-                    'accessConfigs': [
-                        {'type': 'ONE_TO_ONE_NAT', 'name': 'External NAT'}
-                    ],
-                }
-            ],
-            'serviceAccounts': [
-                {
-                    'email': 'default',
-                    'scopes': [
-                        'https://www.googleapis.com/auth/devstorage.read_write',
-                        'https://www.googleapis.com/auth/logging.write',
-                        'https://www.googleapis.com/auth/compute',
-                    ],
-                }
-            ],
-            'metadata': {
-                'items': [{'key': 'startup-script', 'value': startup_script}]
-            },
-        }
+    specs: List[dict]
+        list of keyword arguments for `spawn`, eg, [{'cluster_name': 'dask-a', 'cpu': 2, ...}].
+    **kwargs:
+        Keyword arguments shared by all specs, overwritten by keys inside each spec.
 
-        if preemptible:
-            config['scheduling'] = {'preemptible': True}
+    Returns
+    -------
+    list: [{'cluster_name': cluster_name, 'result': {'ip', 'internal_ip'} or None, 'error': Exception or None}]
+    """
 
-        operation = (
-            compute.instances()
-            .insert(project = project, zone = zone, body = config)
-            .execute()
+    async def spawn_all():
+        # waiters block on executor threads, give each cluster its own threads.
+        loop = asyncio.get_event_loop()
+        loop.set_default_executor(
+            ThreadPoolExecutor(max_workers = max(8, len(specs) * 2))
         )
+        compute = compute_client()
+        coros = [
+            _spawn_async(compute = compute, **{**kwargs, **spec})
+            for spec in specs
+        ]
+        return await asyncio.gather(*coros, return_exceptions = True)
 
-        print(f'Waiting instance `{cluster_name}` to run.')
-
-        while True:
-            result = (
-                compute.zoneOperations()
-                .get(
-                    project = project,
-                    zone = zone,
-                    operation = operation['name'],
-                )
-                .execute()
+    results = run_coroutine(spawn_all())
+    outputs = []
+    for spec, result in zip(specs, results):
+        cluster_name = spec.get('cluster_name', kwargs.get('cluster_name'))
+        if isinstance(result, BaseException):
+            outputs.append(
+                {'cluster_name': cluster_name, 'result': None, 'error': result}
             )
-
-            if result['status'] == 'DONE':
-                if 'error' in result:
-                    raise Exception(result['error'])
-                else:
-                    print('Done.')
-                break
-
-            time.sleep(1)
-
-        while True:
-            result = (
-                compute.instances()
-                .list(project = project, zone = zone)
-                .execute()
+        else:
+            outputs.append(
+                {'cluster_name': cluster_name, 'result': result, 'error': None}
             )
-            results = result['items'] if 'items' in result else None
-            dask = [r for r in results if r['name'] == cluster_name]
-            if len(dask) > 0:
-                dask = dask[0]
-                ip_address = dask['networkInterfaces'][0]['accessConfigs'][0][
-                    'natIP'
-                ]
-                internal_ip = dask['networkInterfaces'][0]['networkIP']
-                print(ip_address, internal_ip, 'done.')
-
-                break
-
-            time.sleep(5)
-
-        print('Waiting Dask cluster to run.')
-        while True:
-            if port_open(ip_address, 8786) and port_open(ip_address, 8787):
-                print('Done.')
-                break
-            time.sleep(5)
-
-    slack_msg = """
-        Spawned Dask cluster. 
-        *Time spawn*: {exec_date}
-        *Dask cluster name*: {dask_name}
-        *CPU Core*: {cpu}
-        *RAM (MB)*: {ram}
-        *Worker count*: {worker_size}
-        *Dask Dasboard Url*: http://{dask_ip}:8787
-        """.format(
-        exec_date = str(datetime.now()),
-        dask_name = cluster_name,
-        dask_ip = ip_address,
-        cpu = cpu,
-        ram = ram,
-        worker_size = worker_size,
-    )
-    nested_post(slack_msg)
-
-    return {'ip': ip_address, 'internal_ip': internal_ip}
+    return outputs
@@ -0,0 +1,719 @@
+import contextlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+import httplib2
+from googleapiclient.errors import HttpError
+from . import client
+
+ROOT_URL = 'https://compute.googleapis.com/compute/v1'
+WAIT_LIMIT = 120
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+def _error(status, reason, uri = ''):
+    content = {
+        'error': {
+            'code': status,
+            'message': reason,
+            'errors': [{'reason': reason, 'message': reason}],
+        }
+    }
+    return HttpError(
+        httplib2.Response({'status': status}),
+        json.dumps(content).encode('utf-8'),
+        uri = uri,
+    )
+
+
+def _field(resource, path):
+    for key in path.split('.'):
+        if not isinstance(resource, dict):
+            return None
+        resource = resource.get(key)
+    return resource
+
+
+def _match(resource, filter):
+    """
+    subset of GCE filter syntax used by this library, eg, `(labels.a = "b") (status != TERMINATED) (labels.c:*)`.
+    """
+    for field, op, value in re.findall(
+        r'([\w.\-]+)\s*(!=|=|:)\s*"?([^"\s)]*)"?', filter or ''
+    ):
+        found = _field(resource, field)
+        if op == ':':
+            if found is None:
+                return False
+            continue
+        found = '' if found is None else str(found)
+        if (found == value) != (op == '='):
+            return False
+    return True
+
+
+class FakeRequest:
+    """
+    mimic `googleapiclient.http.HttpRequest`, `execute` sleeps the configured latency,
+    raise injected failures, then apply the call on fake state.
+    """
+
+    def __init__(self, backend, method_id, handler, kwargs, uri):
+        self.backend = backend
+        self.methodId = method_id
+        self.handler = handler
+        self.kwargs = kwargs
+        self.uri = uri
+
+    def execute(self, http = None, num_retries = 0):
+        return self.backend._call(self)
+
+
+class _Collection:
+    def __init__(self, backend, name):
+        self._backend = backend
+        self._name = name
+
+    def __getattr__(self, method):
+        handler = getattr(self._backend, f'_{self._name}_{method}', None)
+        if handler is None:
+            raise AttributeError(f'{self._name}.{method} is not supported.')
+
+        def request(**kwargs):
+            path = '/'.join(
+                f'{k}s/{kwargs[k]}'
+                for k in ('project', 'zone')
+                if kwargs.get(k) is not None
+            )
+            return FakeRequest(
+                self._backend,
+                f'compute.{self._name}.{method}',
+                handler,
+                kwargs,
+                f'{ROOT_URL}/{path}/{self._name}',
+            )
+
+        return request
+
+    def list_next(self, previous_request, previous_response):
+        token = previous_response.get('nextPageToken')
+        if not token:
+            return None
+        kwargs = dict(previous_request.kwargs, pageToken = token)
+        return FakeRequest(
+            self._backend,
+            previous_request.methodId,
+            previous_request.handler,
+            kwargs,
+            previous_request.uri,
+        )
+
+
+class FakeCompute:
+    """
+    In-process fake of Compute Engine API, supports methods used by this library for
+    instances, zoneOperations, globalOperations, images, firewalls and regions.
+
+    parameter
+    ---------
+
+    latency: float, (default=0.05)
+        seconds for every api call.
+    scan_latency: float, (default=0.00002)
+        extra seconds per instance inside the zone for `instances.list`, filters scan whole zone.
+    operation_latency: float, (default=0.5)
+        seconds for an operation to be DONE, eg, insert, delete, start.
+    failure_rate: float, (default=0.0)
+        probability an api call failed with `failure_status`.
+    failure_status: int, (default=503)
+        http status for random failures.
+    page_size: int, (default=500)
+        default `maxResults` for list calls.
+    ip: str, (default='127.0.0.1')
+        external IP assigned to every running instance.
+    seed: int, (default=0)
+        random seed for failure injection.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        scan_latency: float = 0.00002,
+        operation_latency: float = 0.5,
+        failure_rate: float = 0.0,
+        failure_status: int = 503,
+        page_size: int = 500,
+        ip: str = '127.0.0.1',
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.scan_latency = scan_latency
+        self.operation_latency = operation_latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.page_size = page_size
+        self.ip = ip
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._failures = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._instances = {}
+        self._operations = {}
+        self._images = {}
+        self._firewalls = {}
+        self._exhausted = set()
+
+    def instances(self):
+        return _Collection(self, 'instances')
+
+    def zoneOperations(self):
+        return _Collection(self, 'zoneOperations')
+
+    def globalOperations(self):
+        return _Collection(self, 'globalOperations')
+
+    def images(self):
+        return _Collection(self, 'images')
+
+    def firewalls(self):
+        return _Collection(self, 'firewalls')
+
+    def regions(self):
+        return _Collection(self, 'regions')
+
+    def exhaust(self, zone: str, exhausted: bool = True):
+        """
+        fail every instance insert inside `zone` with ZONE_RESOURCE_POOL_EXHAUSTED,
+        the operation starts fine and the error only shows when it is DONE, same as GCE.
+        """
+        with self._lock:
+            if exhausted:
+                self._exhausted.add(zone)
+            else:
+                self._exhausted.discard(zone)
+
+    def fail(self, method: str, status: int = 503, times: int = 1):
+        """
+        fail next `times` calls of `method`, eg, `compute.instances.insert`.
+        """
+        with self._lock:
+            self._failures.setdefault(method, []).extend([status] * times)
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def add_image(
+        self, project: str, name: str, family: str = None, labels: dict = None
+    ):
+        with self._lock:
+            return self._add_image(project, name, family, labels)
+
+    def populate(
+        self,
+        project: str,
+        zone: str,
+        count: int,
+        prefix: str = 'inventory',
+        labels: dict = None,
+    ):
+        """
+        add `count` running instances unrelated to any cluster, to simulate a busy zone.
+        """
+        with self._lock:
+            for i in range(count):
+                self._add_instance(
+                    project,
+                    zone,
+                    {'name': f'{prefix}-{i}', 'labels': dict(labels or {})},
+                    running_at = 0,
+                )
+
+    def _call(self, request):
+        with self._lock:
+            self.calls[request.methodId] += 1
+            queued = self._failures.get(request.methodId)
+            status = queued.pop(0) if queued else None
+            if status is None and self._random.random() < self.failure_rate:
+                status = self.failure_status
+            scanned = (
+                len(self._instances)
+                if request.methodId == 'compute.instances.list'
+                else 0
+            )
+        time.sleep(self.latency + self.scan_latency * scanned)
+        if status is not None:
+            reason = 'rateLimitExceeded' if status == 429 else 'backendError'
+            raise _error(status, reason, request.uri)
+        return request.handler(**request.kwargs)
+
+    def _now(self):
+        return time.time()
+
+    def _operation(self, operation_type, target, project, zone = None):
+        now = self._now()
+        name = f'operation-{next(self._ids)}'
+        operation = {
+            'kind': 'compute#operation',
+            'name': name,
+            'operationType': operation_type,
+            'targetLink': target,
+            'startTime': _timestamp(now),
+            '_done_at': now + self.operation_latency,
+        }
+        if zone:
+            operation['zone'] = f'{ROOT_URL}/projects/{project}/zones/{zone}'
+        self._operations[(project, zone, name)] = operation
+        return self._render_operation(operation)
+
+    def _render_operation(self, operation):
+        done = self._now() >= operation['_done_at']
+        rendered = {k: v for k, v in operation.items() if not k.startswith('_')}
+        rendered['status'] = 'DONE' if done else 'RUNNING'
+        rendered['progress'] = 100 if done else 0
+        if done and '_error' in operation:
+            rendered['error'] = operation['_error']
+        return rendered
+
+    def _wait(self, project, zone, operation):
+        with self._lock:
+            found = self._operations.get((project, zone, operation))
+        if found is None:
+            raise _error(404, 'notFound')
+        remaining = found['_done_at'] - self._now()
+        if remaining > 0:
+            time.sleep(min(remaining, WAIT_LIMIT))
+        with self._lock:
+            return self._render_operation(found)
+
+    def _get_operation(self, project, zone, operation):
+        with self._lock:
+            found = self._operations.get((project, zone, operation))
+            if found is None:
+                raise _error(404, 'notFound')
+            return self._render_operation(found)
+
+    def _zoneOperations_wait(self, project, zone, operation):
+        return self._wait(project, zone, operation)
+
+    def _zoneOperations_get(self, project, zone, operation):
+        return self._get_operation(project, zone, operation)
+
+    def _globalOperations_wait(self, project, operation):
+        return self._wait(project, None, operation)
+
+    def _globalOperations_get(self, project, operation):
+        return self._get_operation(project, None, operation)
+
+    def _add_instance(self, project, zone, body, running_at):
+        instance = json.loads(json.dumps(body))
+        name = instance['name']
+        instance.update(
+            {
+                'kind': 'compute#instance',
+                'id': str(next(self._ids)),
+                'zone': f'{ROOT_URL}/projects/{project}/zones/{zone}',
+                'selfLink': f'{ROOT_URL}/projects/{project}/zones/{zone}/instances/{name}',
+                'creationTimestamp': _timestamp(self._now()),
+                'labelFingerprint': str(next(self._ids)),
+                '_timeline': [(running_at, 'RUNNING')],
+            }
+        )
+        instance.setdefault('labels', {})
+        instance.setdefault('metadata', {}).setdefault('items', [])
+        instance['metadata']['fingerprint'] = str(next(self._ids))
+        instance.setdefault('networkInterfaces', [{'accessConfigs': [{}]}])
+        self._instances[(project, zone, name)] = instance
+        return instance
+
+    def _render_instance(self, instance):
+        now = self._now()
+        status, started = 'PROVISIONING', None
+        for at, state in instance['_timeline']:
+            if at <= now:
+                status = state
+                if state == 'RUNNING':
+                    started = at
+        rendered = json.loads(
+            json.dumps(
+                {k: v for k, v in instance.items() if not k.startswith('_')}
+            )
+        )
+        rendered['status'] = status
+        interface = rendered['networkInterfaces'][0]
+        if status == 'RUNNING':
+            interface['networkIP'] = '10.0.0.%d' % (int(instance['id']) % 250 + 2)
+            for access in interface.get('accessConfigs', []):
+                access['natIP'] = self.ip
+            rendered['lastStartTimestamp'] = _timestamp(started)
+        else:
+            for access in interface.get('accessConfigs', []):
+                access.pop('natIP', None)
+        return rendered
+
+    def _instance(self, project, zone, instance):
+        found = self._instances.get((project, zone, instance))
+        if found is None:
+            raise _error(404, 'notFound')
+        return found
+
+    def _instances_get(self, project, zone, instance):
+        with self._lock:
+            return self._render_instance(self._instance(project, zone, instance))
+
+    def _instances_list(
+        self, project, zone, filter = None, maxResults = None, pageToken = None
+    ):
+        with self._lock:
+            items = [
+                self._render_instance(instance)
+                for (p, z, _), instance in sorted(self._instances.items())
+                if (p, z) == (project, zone)
+            ]
+        items = [item for item in items if _match(item, filter)]
+        size = maxResults or self.page_size
+        start = int(pageToken or 0)
+        result = {'kind': 'compute#instanceList', 'items': items[start:start + size]}
+        if start + size < len(items):
+            result['nextPageToken'] = str(start + size)
+        return result
+
+    def _instances_insert(self, project, zone, body):
+        with self._lock:
+            if (project, zone, body['name']) in self._instances:
+                raise _error(409, 'alreadyExists')
+            image = body['disks'][0]['initializeParams']['sourceImage']
+            if not any(i['selfLink'] == image for i in self._images.values()):
+                raise _error(404, 'notFound')
+            if zone in self._exhausted:
+                operation = self._operation(
+                    'insert',
+                    f'{ROOT_URL}/projects/{project}/zones/{zone}/instances/{body["name"]}',
+                    project,
+                    zone,
+                )
+                self._operations[(project, zone, operation['name'])][
+                    '_error'
+                ] = {
+                    'errors': [
+                        {
+                            'code': 'ZONE_RESOURCE_POOL_EXHAUSTED',
+                            'message': f"The zone 'projects/{project}/zones/{zone}' does not have enough resources available to fulfill the request.",
+                        }
+                    ]
+                }
+                return operation
+            instance = self._add_instance(
+                project,
+                zone,
+                body,
+                running_at = self._now() + self.operation_latency,
+            )
+            return self._operation(
+                'insert', instance['selfLink'], project, zone
+            )
+
+    def _instances_delete(self, project, zone, instance):
+        with self._lock:
+            found = self._instance(project, zone, instance)
+            del self._instances[(project, zone, instance)]
+            return self._operation('delete', found['selfLink'], project, zone)
+
+    def _transition(self, project, zone, instance, operation_type, status):
+        with self._lock:
+            found = self._instance(project, zone, instance)
+            found['_timeline'].append(
+                (self._now() + self.operation_latency, status)
+            )
+            return self._operation(
+                operation_type, found['selfLink'], project, zone
+            )
+
+    def _instances_start(self, project, zone, instance):
+        return self._transition(project, zone, instance, 'start', 'RUNNING')
+
+    def _instances_stop(self, project, zone, instance):
+        return self._transition(
+            project, zone, instance, 'stop', 'TERMINATED'
+        )
+
+    def _instances_setName(self, project, zone, instance, body):
+        with self._lock:
+            found = self._instance(project, zone, instance)
+            if body.get('currentName', instance) != instance:
+                raise _error(412, 'conditionNotMet')
+            if (project, zone, body['name']) in self._instances:
+                raise _error(409, 'alreadyExists')
+            del self._instances[(project, zone, instance)]
+            found['name'] = body['name']
+            found['selfLink'] = found['selfLink'].rsplit('/', 1)[0] + '/' + body['name']
+            self._instances[(project, zone, body['name'])] = found
+            return self._operation('setName', found['selfLink'], project, zone)
+
+    def _instances_setMetadata(self, project, zone, instance, body):
+        with self._lock:
+            found = self._instance(project, zone, instance)
+            if body.get('fingerprint') != found['metadata']['fingerprint']:
+                raise _error(412, 'conditionNotMet')
+            found['metadata'] = {
+                'items': list(body.get('items', [])),
+                'fingerprint': str(next(self._ids)),
+            }
+            return self._operation(
+                'setMetadata', found['selfLink'], project, zone
+            )
+
+    def _instances_setLabels(self, project, zone, instance, body):
+        with self._lock:
+            found = self._instance(project, zone, instance)
+            if body.get('labelFingerprint') != found['labelFingerprint']:
+                raise _error(412, 'conditionNotMet')
+            found['labels'] = dict(body.get('labels', {}))
+            found['labelFingerprint'] = str(next(self._ids))
+            return self._operation(
+                'setLabels', found['selfLink'], project, zone
+            )
+
+    def _instances_getGuestAttributes(
+        self, project, zone, instance, queryPath = None
+    ):
+        with self._lock:
+            found = self._render_instance(self._instance(project, zone, instance))
+        if found['status'] != 'RUNNING':
+            return {'queryPath': queryPath, 'queryValue': {'items': []}}
+        started = datetime.fromisoformat(
+            found['lastStartTimestamp']
+        ).timestamp()
+        marks = {'startup-script': started, 'containers-up': started, 'dask-ready': started}
+        items = [
+            {'namespace': 'ondemand-dask', 'key': k, 'value': str(v)}
+            for k, v in marks.items()
+        ]
+        items.append({'namespace': 'ondemand-dask', 'key': 'prebaked', 'value': '1'})
+        return {'queryPath': queryPath, 'queryValue': {'items': items}}
+
+    def _add_image(self, project, name, family = None, labels = None):
+        image = {
+            'kind': 'compute#image',
+            'name': name,
+            'family': family,
+            'labels': dict(labels or {}),
+            'status': 'READY',
+            'selfLink': f'{ROOT_URL}/projects/{project}/global/images/{name}',
+            'creationTimestamp': _timestamp(self._now()),
+        }
+        self._images[(project, name)] = image
+        return image
+
+    def _images_get(self, project, image):
+        with self._lock:
+            found = self._images.get((project, image))
+            if found is None:
+                raise _error(404, 'notFound')
+            return dict(found)
+
+    def _images_getFromFamily(self, project, family):
+        with self._lock:
+            images = [
+                i
+                for (p, _), i in self._images.items()
+                if p == project and i['family'] == family
+            ]
+            if not images:
+                raise _error(404, 'notFound')
+            return dict(max(images, key = lambda i: i['creationTimestamp']))
+
+    def _images_list(
+        self, project, filter = None, maxResults = None, pageToken = None
+    ):
+        with self._lock:
+            items = [
+                dict(i)
+                for (p, _), i in sorted(self._images.items())
+                if p == project and _match(i, filter)
+            ]
+        size = maxResults or self.page_size
+        start = int(pageToken or 0)
+        result = {'kind': 'compute#imageList', 'items': items[start:start + size]}
+        if start + size < len(items):
+            result['nextPageToken'] = str(start + size)
+        return result
+
+    def _images_insert(self, project, body, forceCreate = False):
+        with self._lock:
+            if (project, body['name']) in self._images:
+                raise _error(409, 'alreadyExists')
+            image = self._add_image(
+                project, body['name'], body.get('family'), body.get('labels')
+            )
+            return self._operation('insert', image['selfLink'], project)
+
+    def _images_delete(self, project, image):
+        with self._lock:
+            found = self._images.pop((project, image), None)
+            if found is None:
+                raise _error(404, 'notFound')
+            return self._operation('delete', found['selfLink'], project)
+
+    def _regions_get(self, project, region):
+        return {
+            'kind': 'compute#region',
+            'name': region,
+            'status': 'UP',
+            'zones': [
+                f'{ROOT_URL}/projects/{project}/zones/{region}-{suffix}'
+                for suffix in 'abc'
+            ],
+        }
+
+    def _firewalls_insert(self, project, body):
+        with self._lock:
+            if (project, body['name']) in self._firewalls:
+                raise _error(409, 'alreadyExists')
+            self._firewalls[(project, body['name'])] = dict(body)
+            return self._operation(
+                'insert',
+                f'{ROOT_URL}/projects/{project}/global/firewalls/{body["name"]}',
+                project,
+            )
+
+    def _firewalls_get(self, project, firewall):
+        with self._lock:
+            found = self._firewalls.get((project, firewall))
+            if found is None:
+                raise _error(404, 'notFound')
+            return dict(found)
+
+
+class FakeBlob:
+    def __init__(self, bucket, name, chunk_size = None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+
+    @property
+    def size(self):
+        data = self.bucket._blobs.get(self.name)
+        return None if data is None else len(data)
+
+    def exists(self):
+        self.bucket.client._call('storage.objects.get')
+        return self.name in self.bucket._blobs
+
+    def upload_from_file(self, file_obj, size = None, **kwargs):
+        data = file_obj.read() if size is None else file_obj.read(size)
+        chunk = self.chunk_size or len(data) or 1
+        for start in range(0, max(len(data), 1), chunk):
+            self.bucket.client._call(
+                'storage.objects.insert', len(data[start:start + chunk])
+            )
+        self.bucket._blobs[self.name] = data
+
+    def upload_from_string(self, data, **kwargs):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.bucket.client._call('storage.objects.insert', len(data))
+        self.bucket._blobs[self.name] = data
+
+    def upload_from_filename(self, filename, **kwargs):
+        with open(filename, 'rb') as fopen:
+            self.upload_from_file(fopen)
+
+    def download_as_bytes(self, **kwargs):
+        data = self.bucket._blobs.get(self.name)
+        self.bucket.client._call(
+            'storage.objects.get', len(data) if data else 0
+        )
+        if data is None:
+            raise Exception(f'`{self.name}` not found.')
+        return data
+
+    def download_to_filename(self, filename, **kwargs):
+        data = self.download_as_bytes()
+        with open(filename, 'wb') as fopen:
+            fopen.write(data)
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._blobs = client._buckets.setdefault(name, {})
+
+    def blob(self, name, chunk_size = None):
+        return FakeBlob(self, name, chunk_size = chunk_size)
+
+
+class FakeStorage:
+    """
+    In-process fake of `google.cloud.storage.Client`, every object kept in memory.
+
+    parameter
+    ---------
+
+    latency: float, (default=0.02)
+        seconds for every request.
+    bandwidth: int, (default=100 * 1024 * 1024)
+        bytes per second for uploads and downloads.
+    """
+
+    def __init__(
+        self, latency: float = 0.02, bandwidth: int = 100 * 1024 * 1024
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.calls = Counter()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _call(self, method, size = 0):
+        with self._lock:
+            self.calls[method] += 1
+        time.sleep(self.latency + size / self.bandwidth)
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket, prefix = ''):
+        if isinstance(bucket, str):
+            bucket = self.bucket(bucket)
+        self._call('storage.objects.list')
+        return [
+            FakeBlob(bucket, name)
+            for name in sorted(bucket._blobs)
+            if name.startswith(prefix or '')
+        ]
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+
+@contextlib.contextmanager
+def install(compute = None, storage = None):
+    """
+    use fake backends as process-wide clients inside the context, no credentials needed.
+
+    Example,
+
+    with ondemand_dask.fake.install() as (compute, storage):
+        compute.add_image('project', 'dask-build')
+        ondemand_dask.spawn(...)
+    """
+    compute = compute or FakeCompute()
+    storage = storage or FakeStorage()
+    client.clear_cache()
+    client.use(compute = compute, storage = storage, http = lambda: None)
+    try:
+        yield compute, storage
+    finally:
+        client.clear_cache()
@@ -1,15 +1,109 @@
+import asyncio
+import contextvars
+import functools
 import socket
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from .waiter import execute, wait_for_operation
 
+try:
+    from distributed.comm import connect as dask_connect
+except ImportError:
+    dask_connect = None
 
-def port_open(ip, port):
+_session = requests.Session()
+# metadata server IP, fails fast outside GCE without DNS lookup.
+METADATA = 'http://169.254.169.254/computeMetadata/v1'
+
+
+def port_open(ip, port, timeout = 5):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.settimeout(timeout)
     try:
         s.connect((ip, int(port)))
         s.shutdown(2)
         return True
     except:
         return False
+    finally:
+        s.close()
+
+
+@functools.lru_cache()
+def caller_network():
+    """
+    (project id, network name) of this machine if it runs on GCE, else None. Cached for the process.
+    """
+    headers = {'Metadata-Flavor': 'Google'}
+    try:
+        project = _session.get(
+            f'{METADATA}/project/project-id', headers = headers, timeout = 1
+        )
+        network = _session.get(
+            f'{METADATA}/instance/network-interfaces/0/network',
+            headers = headers,
+            timeout = 1,
+        )
+    except requests.RequestException:
+        return None
+    if project.status_code != 200 or network.status_code != 200:
+        return None
+    return project.text.strip(), network.text.strip().rsplit('/', 1)[-1]
+
+
+def route(ip, internal_ip, project, internal = None, network = 'default'):
+    """
+    host to reach a cluster, internal IP if `internal`, or if None, if this machine runs
+    inside the same project and VPC network as the cluster.
+    """
+    if internal is None:
+        internal = caller_network() == (project, network)
+    return internal_ip if internal and internal_ip else ip
+
+
+async def _identity(ip, port, timeout):
+    comm = await dask_connect(f'tcp://{ip}:{port}', timeout = timeout)
+    try:
+        await comm.write({'op': 'identity', 'reply': True})
+        reply = await comm.read()
+    finally:
+        await comm.close()
+    if reply.get('type') != 'Scheduler':
+        raise Exception(f'unexpected identity reply: {reply}')
+    return reply.get('n_workers', len(reply.get('workers', {})))
+
+
+async def _counts(ip, port, timeout):
+    r = await run_async(
+        requests.get, f'http://{ip}:{port}/json/counts.json', timeout = timeout
+    )
+    r.raise_for_status()
+    return int(r.json()['workers'])
+
+
+async def dask_workers_async(
+    ip, port = 8786, dashboard_port = 8787, timeout = 5
+):
+    """
+    registered worker count of a dask scheduler, None if the scheduler is not ready.
+    Use dask comm `identity` handshake if `distributed` installed, else dashboard `/json/counts.json`.
+    """
+    if dask_connect is not None:
+        try:
+            return await asyncio.wait_for(
+                _identity(ip, port, timeout), timeout = timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            return None
+        except Exception:
+            # incompatible `distributed` version, fallback to dashboard.
+            pass
+    try:
+        return await asyncio.wait_for(
+            _counts(ip, dashboard_port, timeout), timeout = timeout
+        )
+    except Exception:
+        return None
 
 
 def post_slack(
@@ -17,23 +111,36 @@ def post_slack(
     webhook: str = None,
     username: str = 'Dask Alert',
     icon_url: str = 'https://avatars3.githubusercontent.com/u/17131925?s=400&v=4',
+    timeout: int = 10,
     **kwargs
 ):
     payload = {'text': slack_msg, 'username': username, 'icon_url': icon_url}
-    return requests.post(webhook, json = payload).status_code
+    return _session.post(webhook, json = payload, timeout = timeout).status_code
 
 
-def wait_for_operation(compute, project, zone, operation):
-    while True:
-        result = (
-            compute.zoneOperations()
-            .get(project = project, zone = zone, operation = operation)
-            .execute()
-        )
+async def run_async(func, *args, **kwargs):
+    """
+    run blocking function on event loop executor, keep context variables like `asyncio.to_thread`.
+    """
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        None, functools.partial(context.run, func, *args, **kwargs)
+    )
+
 
-        if result['status'] == 'DONE':
-            if 'error' in result:
-                raise Exception(result['error'])
-            return result
+async def execute_async(request):
+    return await run_async(execute, request)
+
+
+def run_coroutine(coro):
+    """
+    run coroutine until complete, works inside a running event loop (eg, jupyter notebook).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
 
-        time.sleep(1)
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        return executor.submit(asyncio.run, coro).result()
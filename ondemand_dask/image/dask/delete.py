@@ -2,9 +2,15 @@ import googleapiclient.discovery
 from dask.distributed import Client
 from datetime import datetime, timedelta
 import time
+import os
+import signal
 import sys
+import threading
 import requests
 import cloudpickle
+import telemetry
+from idle import INTERNAL_CLIENT
+from notify import deliver
 
 
 print(sys.argv)
@@ -17,21 +23,106 @@ expired = int(sys.argv[4])
 with open('post.pkl', 'rb') as fopen:
     post_message = cloudpickle.load(fopen)
 
+telemetry_bucket = os.environ.get('telemetry_bucket')
+recorder = telemetry.Recorder(
+    interval = int(os.environ.get('telemetry_interval') or 10)
+)
+
+
+def flush_telemetry(reason):
+    try:
+        recorder.upload(
+            telemetry_bucket, name, telemetry.shape_from_env(), reason
+        )
+    except Exception as e:
+        print(datetime.now(), 'failed to write telemetry', e)
+
+
+def terminate(signum, frame):
+    # docker stops containers on instance delete or preemption, python as PID 1
+    # ignores SIGTERM without a handler.
+    flush_telemetry('terminated')
+    sys.exit(0)
+
+
+signal.signal(signal.SIGTERM, terminate)
+
+
+metadata = 'http://metadata.google.internal/computeMetadata/v1/instance'
+metadata_headers = {'Metadata-Flavor': 'Google'}
+
+
+def watch_preemption():
+    # long-poll metadata server, GCE gives about 30 seconds notice before stopping.
+    try:
+        r = requests.get(
+            f'{metadata}/scheduling/preemptible',
+            headers = metadata_headers,
+            timeout = 10,
+        )
+        if r.text.strip() != 'TRUE':
+            return
+    except Exception as e:
+        print(datetime.now(), 'failed to check preemptible', e)
+        return
+
+    while True:
+        try:
+            r = requests.get(
+                f'{metadata}/preempted',
+                params = {'wait_for_change': 'true'},
+                headers = metadata_headers,
+                timeout = 3600,
+            )
+            if r.text.strip() == 'TRUE':
+                break
+        except Exception as e:
+            print(datetime.now(), 'failed to watch preemption', e)
+            time.sleep(5)
+
+    flush_telemetry('preempted')
+    slack_msg = """
+        Dask cluster preempted.
+        *Time preempted*: {exec_date}
+        *Dask cluster name*: {dask_name}
+        """.format(
+        exec_date = str(datetime.now()), dask_name = name
+    )
+    deliver(post_message, slack_msg, retries = 2, backoff = 0.5)
+
+
+threading.Thread(target = watch_preemption, daemon = True).start()
+
+
+def idle_seconds(dask_scheduler):
+    return dask_scheduler.plugins['ondemand-idle'].idle_seconds()
+
+
+def status(dask_scheduler):
+    # one scheduler round trip for idle time and telemetry sample.
+    return idle_seconds(dask_scheduler), telemetry.sample(dask_scheduler)
+
 
 while True:
     try:
-        client = Client('dask:8786')
+        client = Client('dask:8786', name = INTERNAL_CLIENT)
         break
     except:
         time.sleep(5)
 
-now = datetime.now()
 while True:
-    workers = client.scheduler_info()['workers']
-    if any([v['metrics']['executing'] != 0 for k, v in workers.items()]):
-        now = datetime.now()
+    try:
+        if telemetry_bucket and recorder.due():
+            idle, row = client.run_on_scheduler(status)
+            recorder.add(row)
+        else:
+            idle = client.run_on_scheduler(idle_seconds)
+    except Exception as e:
+        print(datetime.now(), 'failed to get idle time', e)
+        time.sleep(5)
+        continue
 
-    if (datetime.now() - now).seconds > expired:
+    if idle > expired:
         slack_msg = """
             Gracefully deleted Dask cluster. 
             *Time shutdown*: {exec_date}
@@ -39,9 +130,31 @@ while True:
             """.format(
             exec_date = str(datetime.now()), dask_name = name
         )
-        post_message(slack_msg)
+        # retry before deleting, this instance can not send after deleted.
+        deliver(post_message, slack_msg, retries = 5)
+        flush_telemetry('idle')
         compute = googleapiclient.discovery.build('compute', 'v1')
+        result = (
+            compute.instances()
+            .list(
+                project = project,
+                zone = zone,
+                filter = f'labels.ondemand-dask-cluster = "{name}"',
+            )
+            .execute()
+        )
+        workers = [
+            r['name'] for r in result.get('items', []) if r['name'] != name
+        ]
+        # delete workers first, deleting this instance stops this script.
+        for worker in workers:
+            compute.instances().delete(
+                project = project, zone = zone, instance = worker
+            ).execute()
         compute.instances().delete(
             project = project, zone = zone, instance = name
         ).execute()
         break
+
+    # sleep until the earliest time the cluster can expire, capped to stay responsive.
+    time.sleep(min(max(expired - idle, 1), 10, recorder.interval))
@@ -0,0 +1,70 @@
+import time
+from distributed.diagnostics.plugin import SchedulerPlugin
+
+BUSY_STATES = {'waiting', 'queued', 'processing', 'no-worker'}
+# `Client(name = INTERNAL_CLIENT)` for clients always connected inside the instance,
+# graceful delete watcher and VM scaler, they must not keep the cluster alive.
+INTERNAL_CLIENT = 'ondemand-internal'
+
+
+class IdleTracker(SchedulerPlugin):
+    """
+    Track scheduler idle time from task transition events, a set of busy keys
+    is updated on every transition so reading the idle timer is O(1).
+    A cluster is busy while any task waiting, queued, processing or no-worker, or while
+    any client is connected, eg, a notebook holding futures. Clients named `INTERNAL_CLIENT`
+    do not count, matched by name so they still do not count after the scheduler restarted.
+    Completed tasks are counted for throughput telemetry.
+    """
+
+    name = 'ondemand-idle'
+
+    def __init__(self):
+        self.busy = set()
+        self.clients = set()
+        self.last_active = time.time()
+        self.completed = 0
+
+    def touch(self):
+        self.last_active = time.time()
+
+    def transition(self, key, start, finish, *args, **kwargs):
+        if finish in BUSY_STATES:
+            self.busy.add(key)
+        else:
+            self.busy.discard(key)
+        if start == 'processing' and finish == 'memory':
+            self.completed += 1
+        self.touch()
+
+    def update_graph(self, *args, **kwargs):
+        self.touch()
+
+    def add_client(self, scheduler = None, client = None, **kwargs):
+        # client id is `Client-{name}-{uuid}`.
+        if not client.startswith(f'Client-{INTERNAL_CLIENT}-'):
+            self.clients.add(client)
+        self.touch()
+
+    def remove_client(self, scheduler = None, client = None, **kwargs):
+        self.clients.discard(client)
+        self.touch()
+
+    def idle_seconds(self):
+        if self.busy or self.clients:
+            self.touch()
+        return time.time() - self.last_active
+
+
+def dask_setup(scheduler):
+    tracker = IdleTracker()
+    scheduler.add_plugin(tracker, name = IdleTracker.name)
+
+    def idle_seconds(comm = None):
+        return tracker.idle_seconds()
+
+    def touch(comm = None):
+        tracker.touch()
+
+    scheduler.handlers['idle_seconds'] = idle_seconds
+    scheduler.handlers['touch'] = touch
@@ -1,17 +1,104 @@
+import asyncio
+import os
 import time
-from dask.distributed import Client, LocalCluster
+from dask.distributed import Client, LocalCluster, Nanny
 import sys
+import dask
+
+
+def env(key, default = None):
+    return os.environ.get(key) or default
+
+
+worker = int(env('worker_size', 1))
+role = env('role', 'local')
+scheduler = env('scheduler')
+adaptive = env('adaptive') == '1'
+minimum = int(env('minimum', 0))
+threads_per_worker = int(env('threads_per_worker', 1))
+memory_limit = env('memory_limit')
+memory_limit = f'{memory_limit}MiB' if memory_limit else 'auto'
+print(
+    worker, role, scheduler, adaptive, minimum, threads_per_worker, memory_limit
+)
+
+
+def fraction(value):
+    return False if value == 'false' else float(value)
+
+
+# nanny ships this config to every worker process.
+dask.config.set(
+    {
+        f'distributed.worker.memory.{key}': fraction(env(f'memory_{key}'))
+        for key in ('target', 'spill', 'pause', 'terminate')
+        if env(f'memory_{key}')
+    }
+)
+# /scratch is the host scratch volume, local SSD if attached.
+if os.path.isdir('/scratch'):
+    dask.config.set({'temporary-directory': '/scratch'})
+# node-local read cache for gs:// files, on the same scratch volume.
+if int(env('read_cache', 0)):
+    dask.config.set({'distributed.worker.preload': ['/app/cache.py']})
+# comm compression between scheduler, workers and clients, lz4 is installed in the image.
+compression = env('compression', 'auto')
+dask.config.set(
+    {
+        'distributed.comm.compression': {'auto': 'lz4', 'none': False}.get(
+            compression, compression
+        )
+    }
+)
+
+
+async def run_workers(address, n):
+    nannies = [
+        Nanny(
+            address,
+            nthreads = threads_per_worker,
+            memory_limit = memory_limit,
+        )
+        for _ in range(n)
+    ]
+    await asyncio.gather(*nannies)
+    await asyncio.gather(*[nanny.finished() for nanny in nannies])
 
-print(sys.argv)
-worker = int(sys.argv[1])
 
 if __name__ == '__main__':
+    if role == 'worker':
+        asyncio.get_event_loop().run_until_complete(
+            run_workers(f'tcp://{scheduler}:8786', worker)
+        )
+        sys.exit(1)
+
     cluster = LocalCluster(
-        n_workers = worker,
+        n_workers = 0 if role == 'scheduler' else worker,
+        threads_per_worker = threads_per_worker,
+        memory_limit = memory_limit,
+        processes = True,
         scheduler_port = 8786,
         host = '0.0.0.0',
         dashboard_address = '0.0.0.0:8787',
+        scheduler_kwargs = {'preload': ['/app/idle.py']},
     )
 
+    if adaptive and role == 'scheduler':
+        from idle import INTERNAL_CLIENT
+        from scale import VMScaler
+
+        scaler = VMScaler(
+            client = Client(cluster, name = INTERNAL_CLIENT),
+            name = env('name'),
+            project = env('project'),
+            zone = env('zone'),
+            worker_size = worker,
+            minimum = minimum,
+        )
+        scaler.run()
+
+    elif adaptive:
+        cluster.adapt(minimum = minimum, maximum = worker)
+
     while True:
         time.sleep(600)
@@ -0,0 +1,133 @@
+import googleapiclient.discovery
+import math
+import threading
+import time
+from datetime import datetime
+
+
+def adaptive_target(dask_scheduler):
+    return dask_scheduler.adaptive_target()
+
+
+class VMScaler:
+    """
+    Start and stop worker instances of a multi-node cluster using scheduler
+    `adaptive_target`, which considers task backlog and worker memory.
+    Stopped instances keep their disk and rejoin the scheduler on boot.
+    """
+
+    def __init__(
+        self,
+        client,
+        name,
+        project,
+        zone,
+        worker_size,
+        minimum = 0,
+        interval = 30,
+        wait_count = 3,
+    ):
+        self.client = client
+        self.name = name
+        self.project = project
+        self.zone = zone
+        self.worker_size = worker_size
+        self.minimum = minimum
+        self.interval = interval
+        self.wait_count = wait_count
+        self.compute = googleapiclient.discovery.build('compute', 'v1')
+        self._close_count = 0
+
+    def instances(self):
+        result = (
+            self.compute.instances()
+            .list(
+                project = self.project,
+                zone = self.zone,
+                filter = f'(labels.ondemand-dask-cluster = "{self.name}") (labels.ondemand-dask-role = "worker")',
+            )
+            .execute()
+        )
+        return result.get('items', [])
+
+    def target(self, maximum):
+        workers = self.client.run_on_scheduler(adaptive_target)
+        target = math.ceil(workers / self.worker_size)
+        return min(max(target, self.minimum), maximum)
+
+    def scale_up(self, instances):
+        for instance in instances:
+            print(datetime.now(), 'starting', instance['name'])
+            self.compute.instances().start(
+                project = self.project,
+                zone = self.zone,
+                instance = instance['name'],
+            ).execute()
+
+    def scale_down(self, instances):
+        hosts = {i['networkInterfaces'][0]['networkIP'] for i in instances}
+        workers = self.client.scheduler_info()['workers']
+        retire = [
+            address
+            for address, worker in workers.items()
+            if worker['host'] in hosts
+        ]
+        if retire:
+            self.client.retire_workers(workers = retire, close_workers = True)
+        for instance in instances:
+            print(datetime.now(), 'stopping', instance['name'])
+            self.compute.instances().stop(
+                project = self.project,
+                zone = self.zone,
+                instance = instance['name'],
+            ).execute()
+
+    def step(self):
+        instances = self.instances()
+        stopped = [i for i in instances if i['status'] == 'TERMINATED']
+        starting = [
+            i
+            for i in instances
+            if i['status'] in ('PROVISIONING', 'STAGING')
+        ]
+        running = [i for i in instances if i['status'] == 'RUNNING']
+        active = len(starting) + len(running)
+        target = self.target(len(instances))
+
+        if target > active:
+            self._close_count = 0
+            self.scale_up(stopped[: target - active])
+
+        elif target < active:
+            # scale down only after consecutive recommendations, same as dask Adaptive.
+            self._close_count += 1
+            if self._close_count >= self.wait_count:
+                self._close_count = 0
+                workers = self.client.scheduler_info()['workers']
+                memory = {}
+                for worker in workers.values():
+                    memory[worker['host']] = memory.get(
+                        worker['host'], 0
+                    ) + worker['metrics']['memory']
+                running = sorted(
+                    running,
+                    key = lambda i: memory.get(
+                        i['networkInterfaces'][0]['networkIP'], 0
+                    ),
+                )
+                self.scale_down(running[: max(active - target, 0)])
+        else:
+            self._close_count = 0
+
+    def run(self):
+        def loop():
+            while True:
+                try:
+                    self.step()
+                except Exception as e:
+                    print(datetime.now(), 'scaler error', e)
+                time.sleep(self.interval)
+
+        thread = threading.Thread(target = loop, daemon = True)
+        thread.start()
+        return thread
@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+
+PREFIX = 'ondemand-dask-telemetry'
+COLUMNS = [
+    'time',
+    'workers',
+    'nthreads',
+    'cpu',
+    'cpu_max',
+    'memory',
+    'memory_max',
+    'memory_limit',
+    'spilled',
+    'processing',
+    'completed',
+]
+
+
+def sample(dask_scheduler):
+    """
+    one row of `COLUMNS` from worker heartbeats the scheduler already has, no worker round trip.
+    `cpu` is percent summed across workers, 100 is one core busy, `memory_max` is the
+    highest worker memory as fraction of its limit.
+    """
+    cpu = cpu_max = memory = memory_max = limit = spilled = 0
+    nthreads = processing = 0
+    for ws in dask_scheduler.workers.values():
+        metrics = ws.metrics
+        worker_cpu = metrics.get('cpu') or 0
+        cpu += worker_cpu
+        cpu_max = max(cpu_max, worker_cpu)
+        memory += metrics.get('memory') or 0
+        if ws.memory_limit:
+            limit += ws.memory_limit
+            memory_max = max(
+                memory_max, (metrics.get('memory') or 0) / ws.memory_limit
+            )
+        spill = metrics.get('spilled_bytes') or metrics.get('spilled_nbytes')
+        if isinstance(spill, dict):
+            spilled += spill.get('disk', 0)
+        nthreads += ws.nthreads
+        processing += len(ws.processing)
+    tracker = dask_scheduler.plugins.get('ondemand-idle')
+    return [
+        round(time.time(), 1),
+        len(dask_scheduler.workers),
+        nthreads,
+        round(cpu, 1),
+        round(cpu_max, 1),
+        int(memory),
+        round(memory_max, 3),
+        int(limit),
+        int(spilled),
+        processing,
+        getattr(tracker, 'completed', 0),
+    ]
+
+
+class Recorder:
+    """
+    keep samples in memory, halve the resolution after `limit` rows so a long running
+    cluster still writes a small file.
+    """
+
+    def __init__(self, interval = 10, limit = 4096):
+        self.interval = interval
+        self.limit = limit
+        self.rows = []
+        self.started = time.time()
+        self.written = False
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def due(self):
+        return time.time() - self._last >= self.interval
+
+    def add(self, row):
+        with self._lock:
+            self._last = time.time()
+            self.rows.append(row)
+            if len(self.rows) > self.limit:
+                self.rows = self.rows[::2]
+                self.interval *= 2
+
+    def upload(self, bucket_name, name, shape, reason):
+        """
+        write `gs://{bucket_name}/{PREFIX}/{name}/{started}.json` once, later calls do nothing.
+        """
+        with self._lock:
+            if self.written or not bucket_name:
+                return
+            self.written = True
+            body = {
+                'cluster_name': name,
+                'started': self.started,
+                'finished': time.time(),
+                'reason': reason,
+                'shape': shape,
+                'columns': COLUMNS,
+                'rows': self.rows,
+            }
+        from google.cloud import storage
+
+        started = time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.started))
+        blob = (
+            storage.Client()
+            .bucket(bucket_name)
+            .blob(f'{PREFIX}/{name}/{started}.json')
+        )
+        blob.upload_from_string(
+            json.dumps(body, separators = (',', ':')),
+            content_type = 'application/json',
+        )
+        print(f'wrote {len(body["rows"])} telemetry samples to {blob.name}')
+
+
+def shape_from_env():
+    keys = (
+        'cpu',
+        'ram',
+        'worker_size',
+        'workers',
+        'threads_per_worker',
+        'memory_limit',
+    )
+    return {
+        key: int(os.environ[key]) for key in keys if os.environ.get(key)
+    }
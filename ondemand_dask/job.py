@@ -0,0 +1,172 @@
+import os
+import sys
+import uuid
+import cloudpickle
+from datetime import datetime
+from herpetologist import check_type
+from .session import connect
+
+# dask image may have an older ondemand-dask installed, ship `_runner` by value.
+cloudpickle.register_pickle_by_value(sys.modules[__name__])
+
+
+def _runner(job, job_args, job_kwargs, bucket_name, location, script_name):
+    import contextlib
+    import io
+    import json
+    import sys
+    import time
+    import traceback
+    import cloudpickle
+    from distributed import secede
+    from google.cloud import storage
+
+    # leave the worker thread slot, the job can submit more tasks to the cluster.
+    secede()
+    logs = io.StringIO()
+    started = time.time()
+    result, error = None, None
+    argv = sys.argv
+    with contextlib.redirect_stdout(logs), contextlib.redirect_stderr(logs):
+        try:
+            if script_name:
+                sys.argv = [script_name] + [str(a) for a in job_args]
+                namespace = {'__name__': '__main__', '__file__': script_name}
+                exec(compile(job, script_name, 'exec'), namespace)
+            else:
+                result = job(*job_args, **job_kwargs)
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            sys.argv = argv
+
+    status = {
+        'status': 'failed' if error else 'succeeded',
+        'error': error,
+        'started': started,
+        'finished': time.time(),
+        'seconds': round(time.time() - started, 3),
+    }
+    bucket = storage.Client().bucket(bucket_name)
+    bucket.blob(f'{location}/logs.txt').upload_from_string(logs.getvalue())
+    if error is None:
+        bucket.blob(f'{location}/result.pkl').upload_from_string(
+            cloudpickle.dumps(result)
+        )
+    bucket.blob(f'{location}/status.json').upload_from_string(
+        json.dumps(status)
+    )
+    return status, result
+
+
+@check_type
+def run_job(
+    job,
+    cluster_name: str,
+    image_name: str,
+    project: str,
+    zone: str,
+    cpu: int,
+    ram: int,
+    worker_size: int,
+    bucket_name: str,
+    prefix: str = 'ondemand-dask-jobs',
+    job_args: list = [],
+    job_kwargs: dict = {},
+    delete_on_exit: bool = True,
+    raise_error: bool = True,
+    **kwargs,
+):
+    """
+    function to spawn a dask cluster, run a job on it, persist result and logs to a bucket,
+    then delete the cluster as soon as the job finished. `graceful_delete` is only a safety net
+    if this process died before the job finished.
+
+    parameter
+    ---------
+
+    job: Callable or str
+        python function, or file path of a python script. A function can use
+        `dask.distributed.get_client()` to submit more tasks.
+    cluster_name: str
+        dask cluster name.
+    image_name: str
+        image name we built.
+    project: str
+        project id inside gcp.
+    zone: str
+        compute zone for the cluster.
+    cpu: int
+        cpu core count.
+    ram: int
+        ram size in term of MB.
+    worker_size: int
+        worker size of dask cluster.
+    bucket_name: str
+        bucket to store `status.json`, `logs.txt` and `result.pkl` of the job.
+    prefix: str, (default='ondemand-dask-jobs')
+        prefix inside the bucket, files stored in `{prefix}/{job_id}/`.
+    job_args: list, (default=[])
+        positional arguments for the function, or `sys.argv` for the script.
+    job_kwargs: dict, (default={})
+        keyword arguments for the function.
+    delete_on_exit: bool, (default=True)
+        if True, will delete the cluster after the job finished.
+    raise_error: bool, (default=True)
+        if True, will raise exception if the job failed, after the cluster deleted.
+    **kwargs:
+        Keyword arguments to pass to `ondemand_dask.spawn`.
+
+    Returns
+    -------
+    dictionary: {'job_id', 'status', 'error', 'result', 'seconds', 'location'}
+    """
+
+    script_name = None
+    if isinstance(job, str):
+        script_name = os.path.basename(job)
+        with open(job) as fopen:
+            job = fopen.read()
+    elif not callable(job):
+        raise Exception('`job` must be a function or a python script path.')
+
+    job_id = f'{cluster_name}-{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}'
+    location = f'{prefix.strip("/")}/{job_id}'
+
+    kwargs.setdefault('ready_workers', 1)
+    with connect(
+        cluster_name = cluster_name,
+        image_name = image_name,
+        project = project,
+        zone = zone,
+        cpu = cpu,
+        ram = ram,
+        worker_size = worker_size,
+        delete_on_exit = delete_on_exit,
+        **kwargs,
+    ) as client:
+        print(f'Running job `{job_id}`.')
+        future = client.submit(
+            _runner,
+            job,
+            job_args,
+            job_kwargs,
+            bucket_name,
+            location,
+            script_name,
+            pure = False,
+        )
+        status, result = future.result()
+        print(f'Job `{job_id}` {status["status"]} in {status["seconds"]} seconds.')
+
+    output = {
+        'job_id': job_id,
+        'status': status['status'],
+        'error': status['error'],
+        'result': result,
+        'seconds': status['seconds'],
+        'location': f'gs://{bucket_name}/{location}/',
+    }
+    if raise_error and status['error']:
+        raise Exception(f'job `{job_id}` failed,\n{status["error"]}')
+    return output
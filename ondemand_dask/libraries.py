@@ -10,6 +10,8 @@ important_libraries = [
     'gcsfs',
     'sqlalchemy',
     'dill',
+    'lz4',
+    'zstandard',
 ]
 
 extra_libraries = [
@@ -0,0 +1,255 @@
+import contextvars
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_hooks = []
+_hooks_lock = threading.Lock()
+_current = contextvars.ContextVar('ondemand_dask_timings', default = None)
+
+
+def add_hook(hook):
+    """
+    register a callable receiving every event dictionary.
+    """
+    with _hooks_lock:
+        _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def emit(event: dict):
+    event.setdefault('time', time.time())
+    with _hooks_lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception as e:
+            print(f'metrics hook {hook} failed: {e}')
+
+
+def api_call(method: str):
+    timings = _current.get()
+    if timings is not None:
+        timings._count('api_calls')
+    emit(
+        {
+            'event': 'api_call',
+            'method': method,
+            **(timings.labels() if timings else {}),
+        }
+    )
+
+
+def retry(method: str, status: int):
+    timings = _current.get()
+    if timings is not None:
+        timings._count('retries')
+    emit(
+        {
+            'event': 'retry',
+            'method': method,
+            'status': status,
+            **(timings.labels() if timings else {}),
+        }
+    )
+
+
+class Timings:
+    """
+    Per-phase timings, API call and retry counts of one `spawn`, `delete` or `build_image`.
+    API calls inside `with Timings(...)` are counted, including calls on executor threads
+    started using `ondemand_dask.function.run_async`.
+    """
+
+    def __init__(self, operation: str, name: str = None):
+        self.operation = operation
+        self.name = name
+        self.phases = {}
+        self.api_calls = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._start = None
+        self._last = None
+        self._token = None
+
+    def labels(self):
+        return {'operation': self.operation, 'name': self.name}
+
+    def _count(self, key):
+        with self._lock:
+            setattr(self, key, getattr(self, key) + 1)
+
+    def lap(self, phase: str):
+        """
+        record seconds since previous lap, or since start, as `phase`.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            seconds = now - self._last
+            self._last = now
+            self.phases[phase] = self.phases.get(phase, 0) + seconds
+        emit(
+            {
+                'event': 'phase',
+                'phase': phase,
+                'seconds': seconds,
+                **self.labels(),
+            }
+        )
+        return seconds
+
+    def __enter__(self):
+        self._start = self._last = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        emit(
+            {
+                'event': 'total',
+                'seconds': time.perf_counter() - self._start,
+                'api_calls': self.api_calls,
+                'retries': self.retries,
+                'error': None if exc is None else repr(exc),
+                **self.labels(),
+            }
+        )
+
+    def result(self):
+        total = None
+        if self._start is not None:
+            total = time.perf_counter() - self._start
+        return {
+            'phases': {k: round(v, 3) for k, v in self.phases.items()},
+            'total': None if total is None else round(total, 3),
+            'api_calls': self.api_calls,
+            'retries': self.retries,
+        }
+
+
+class JSONLinesSink:
+    """
+    append every event as a JSON line.
+
+    parameter
+    ---------
+
+    path: str
+        file path to append.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default = str)
+        with self._lock:
+            with open(self.path, 'a') as fopen:
+                fopen.write(line + '\n')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+class PrometheusExporter:
+    """
+    aggregate events as OpenMetrics counters and summaries, `serve` exposes `/metrics`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.summaries = {}
+        self._server = None
+
+    def __call__(self, event):
+        kind = event.get('event')
+        with self._lock:
+            if kind == 'api_call':
+                key = ('ondemand_dask_api_calls', (('method', event['method']),))
+                self.counters[key] = self.counters.get(key, 0) + 1
+            elif kind == 'retry':
+                key = (
+                    'ondemand_dask_api_retries',
+                    (
+                        ('method', event['method']),
+                        ('status', event['status']),
+                    ),
+                )
+                self.counters[key] = self.counters.get(key, 0) + 1
+            elif kind in ('phase', 'total'):
+                labels = [('operation', event.get('operation'))]
+                if kind == 'phase':
+                    labels.append(('phase', event['phase']))
+                key = (f'ondemand_dask_{kind}_seconds', tuple(labels))
+                count, total = self.summaries.get(key, (0, 0.0))
+                self.summaries[key] = (count + 1, total + event['seconds'])
+
+    def render(self):
+        def labels(pairs):
+            inner = ','.join(f'{k}="{_escape(v)}"' for k, v in pairs)
+            return '{' + inner + '}' if inner else ''
+
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f'# TYPE {name} counter')
+                for (n, pairs), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f'{name}_total{labels(pairs)} {value}')
+            names = sorted({name for name, _ in self.summaries})
+            for name in names:
+                lines.append(f'# TYPE {name} summary')
+                for (n, pairs), (count, total) in sorted(
+                    self.summaries.items()
+                ):
+                    if n == name:
+                        lines.append(f'{name}_count{labels(pairs)} {count}')
+                        lines.append(f'{name}_sum{labels(pairs)} {total}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9090, host: str = '0.0.0.0'):
+        """
+        serve `/metrics` on a background thread.
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type',
+                    'application/openmetrics-text; version=1.0.0; charset=utf-8',
+                )
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(
+            target = self._server.serve_forever, daemon = True
+        )
+        thread.start()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
@@ -0,0 +1,189 @@
+import atexit
+import queue
+import random
+import textwrap
+import threading
+import time
+
+# only depends on standard library, also copied into the dask image for `delete.py`.
+
+_FLUSH = object()
+_STOP = object()
+_lock = threading.Lock()
+_dispatcher = None
+
+
+def deliver(post, message, retries: int = 3, backoff: float = 1.0):
+    """
+    call `post(message)` until it returned 200, retry with exponential backoff.
+
+    Returns
+    -------
+    result: bool
+    """
+    delay = backoff
+    for attempt in range(retries + 1):
+        try:
+            status = post(message)
+            if status == 200:
+                return True
+            error = f'status {status}'
+        except Exception as e:
+            error = e
+        if attempt < retries:
+            time.sleep(delay / 2 + random.uniform(0, delay / 2))
+            delay *= 2
+    print(f'failed to deliver webhook message after {retries + 1} attempts: {error}')
+    return False
+
+
+def digest(messages):
+    """
+    combine messages into one, single message returned as it is.
+    """
+    if len(messages) == 1:
+        return messages[0]
+    messages = [textwrap.dedent(m).strip() for m in messages]
+    return f'*{len(messages)} notifications*\n\n' + '\n\n'.join(messages)
+
+
+class Dispatcher:
+    """
+    Send webhook messages on a background thread. Messages for the same webhook arrived
+    within `window` seconds of each other are coalesced into one digest.
+
+    parameter
+    ---------
+
+    window: float, (default=2.0)
+        seconds to wait for more messages before sending a digest.
+    max_delay: float, (default=10.0)
+        maximum seconds a message can wait for coalescing.
+    retries: int, (default=3)
+        retries for each digest if webhook not returned 200.
+    backoff: float, (default=1.0)
+        initial seconds between retries, doubled after every retry.
+    """
+
+    def __init__(
+        self,
+        window: float = 2.0,
+        max_delay: float = 10.0,
+        retries: int = 3,
+        backoff: float = 1.0,
+    ):
+        self.window = window
+        self.max_delay = max_delay
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._condition = threading.Condition()
+        self._unfinished = 0
+        self._thread = None
+
+    def send(self, post, message, key = None):
+        """
+        queue `message` for `post`, return immediately. Messages with the same `key`
+        are coalesced, default key is `post`.
+        """
+        with self._condition:
+            self._unfinished += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target = self._run, name = 'ondemand-dask-notify', daemon = True
+                )
+                self._thread.start()
+        self._queue.put((post if key is None else key, post, message))
+
+    def flush(self, timeout: float = None):
+        """
+        send pending messages without waiting the window, block until delivered.
+
+        Returns
+        -------
+        result: bool, False if timed out.
+        """
+        self._queue.put(_FLUSH)
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._unfinished == 0, timeout = timeout
+            )
+
+    def close(self, timeout: float = None):
+        """
+        deliver pending messages and stop the background thread.
+        """
+        flushed = self.flush(timeout = timeout)
+        self._queue.put(_STOP)
+        if self._thread is not None:
+            self._thread.join(timeout = timeout)
+        return flushed
+
+    def _deliver(self, group):
+        try:
+            deliver(
+                group['post'],
+                digest(group['messages']),
+                retries = self.retries,
+                backoff = self.backoff,
+            )
+        finally:
+            with self._condition:
+                self._unfinished -= len(group['messages'])
+                self._condition.notify_all()
+
+    def _run(self):
+        pending = {}
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(
+                    min(
+                        min(
+                            g['last'] + self.window,
+                            g['first'] + self.max_delay,
+                        )
+                        for g in pending.values()
+                    )
+                    - time.monotonic(),
+                    0,
+                )
+            try:
+                item = self._queue.get(timeout = timeout)
+            except queue.Empty:
+                item = None
+
+            now = time.monotonic()
+            force = item is _FLUSH or item is _STOP
+            if item is not None and not force:
+                key, post, message = item
+                group = pending.setdefault(
+                    key, {'post': post, 'messages': [], 'first': now}
+                )
+                group['messages'].append(message)
+                group['last'] = now
+
+            for key, group in list(pending.items()):
+                if (
+                    force
+                    or now - group['last'] >= self.window
+                    or now - group['first'] >= self.max_delay
+                ):
+                    del pending[key]
+                    self._deliver(group)
+
+            if item is _STOP:
+                return
+
+
+def dispatcher():
+    """
+    process-wide dispatcher, pending messages are delivered at interpreter exit.
+    """
+    global _dispatcher
+
+    with _lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher()
+            atexit.register(_dispatcher.close, 30)
+        return _dispatcher
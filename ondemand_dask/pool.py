@@ -0,0 +1,354 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from herpetologist import check_type
+from .client import compute_client
+from .core import (
+    CLUSTER_LABEL,
+    DOCKER_IMAGE,
+    _instance_config,
+    disk_types,
+    _startup_script,
+)
+from .waiter import (
+    Backoff,
+    execute,
+    get_instance,
+    wait_for_instance,
+    wait_for_operation,
+)
+
+POOL_LABEL = 'ondemand-dask-pool'
+SHAPE_LABEL = 'ondemand-dask-shape'
+
+# build docker image if the disk image is not pre-baked, then power off and wait to be claimed.
+warm_script = f'docker image inspect {DOCKER_IMAGE} || docker-compose -f docker-compose.yaml build; shutdown -h now'
+
+
+def shape(cpu, ram, worker_size):
+    return f'c{cpu}-r{ram}-w{worker_size}'
+
+
+class WarmPool:
+    """
+    Keep `size` stopped instances per (cpu, ram, worker_size) shape, built from `image_name`.
+    A stopped instance only pays for its disk, `acquire` rename it to the cluster name,
+    re-set the startup metadata and start it, so no instance creation and first boot on spawn.
+
+    Instances are stopped instead of suspended, startup script only runs on boot,
+    a resumed instance would keep running containers with old `worker_size` and `name`.
+
+    parameter
+    ---------
+
+    image_name: str
+        image name we built.
+    project: str
+        project id inside gcp.
+    zone: str
+        compute zone for the pool.
+    size: int, (default=1)
+        stopped instances to keep for each shape.
+    prefix: str, (default='dask-pool')
+        instance name prefix and pool label, must be lowercase.
+    disk_size: int, (default=10)
+        Disk size (GB) for pool instances.
+    disk_type: str, (default='pd-standard')
+        boot disk type for pool instances, one of 'pd-standard', 'pd-balanced' and 'pd-ssd'.
+    preemptible: bool, (default=False)
+        if True, pool instances will use preemptible VM.
+    refill: bool, (default=True)
+        if True, will refill the pool in background after `acquire`.
+    """
+
+    @check_type
+    def __init__(
+        self,
+        image_name: str,
+        project: str,
+        zone: str,
+        size: int = 1,
+        prefix: str = 'dask-pool',
+        disk_size: int = 10,
+        disk_type: str = 'pd-standard',
+        preemptible: bool = False,
+        refill: bool = True,
+    ):
+        if size < 0:
+            raise Exception('size must be bigger or equal than 0')
+        if disk_type not in disk_types:
+            raise Exception(f'`disk_type` must be one of {disk_types}')
+
+        self.image_name = image_name
+        self.project = project
+        self.zone = zone
+        self.size = size
+        self.prefix = prefix
+        self.disk_size = disk_size
+        self.disk_type = disk_type
+        self.preemptible = preemptible
+        self.refill = refill
+        self._executor = ThreadPoolExecutor(max_workers = 1)
+        self._lock = threading.Lock()
+
+    def _filter(self, cpu, ram, worker_size, status = None):
+        filters = [
+            f'(labels.{POOL_LABEL} = "{self.prefix}")',
+            f'(labels.{SHAPE_LABEL} = "{shape(cpu, ram, worker_size)}")',
+        ]
+        if status:
+            filters.append(f'(status = {status})')
+        return ' '.join(filters)
+
+    def instances(self, cpu: int, ram: int, worker_size: int, status = None):
+        """
+        list pool instances for a shape, `status='TERMINATED'` means ready to acquire.
+        """
+        compute = compute_client()
+        request = compute.instances().list(
+            project = self.project,
+            zone = self.zone,
+            filter = self._filter(cpu, ram, worker_size, status = status),
+        )
+        instances = []
+        while request is not None:
+            result = execute(request)
+            instances.extend(result.get('items', []))
+            request = compute.instances().list_next(request, result)
+        return instances
+
+    def available(self, cpu: int, ram: int, worker_size: int):
+        return self.instances(cpu, ram, worker_size, status = 'TERMINATED')
+
+    def fill(
+        self,
+        cpu: int,
+        ram: int,
+        worker_size: int,
+        wait: bool = False,
+        timeout: int = None,
+    ):
+        """
+        insert missing pool instances for a shape.
+
+        parameter
+        ---------
+
+        wait: bool, (default=False)
+            if True, will wait all pool instances warmed and stopped.
+        timeout: int, (default=None)
+            maximum seconds to wait if `wait` is True.
+
+        Returns
+        -------
+        result: int, count of new instances.
+        """
+        compute = compute_client()
+        with self._lock:
+            missing = self.size - len(self.instances(cpu, ram, worker_size))
+            if missing > 0:
+                image_response = execute(
+                    compute.images().get(
+                        project = self.project, image = self.image_name
+                    )
+                )
+                operations = []
+                for _ in range(missing):
+                    name = f'{self.prefix}-{shape(cpu, ram, worker_size)}-{uuid.uuid4().hex[:6]}'
+                    config = _instance_config(
+                        cluster_name = name,
+                        source_disk_image = image_response['selfLink'],
+                        project = self.project,
+                        zone = self.zone,
+                        cpu = cpu,
+                        ram = ram,
+                        worker_size = worker_size,
+                        disk_size = self.disk_size,
+                        disk_type = self.disk_type,
+                        preemptible = self.preemptible,
+                        graceful_delete = 0,
+                        startup_script = warm_script,
+                        labels = {
+                            POOL_LABEL: self.prefix,
+                            SHAPE_LABEL: shape(cpu, ram, worker_size),
+                        },
+                    )
+                    operations.append(
+                        execute(
+                            compute.instances().insert(
+                                project = self.project,
+                                zone = self.zone,
+                                body = config,
+                            )
+                        )
+                    )
+                for operation in operations:
+                    wait_for_operation(
+                        compute, self.project, self.zone, operation['name']
+                    )
+
+        if wait:
+            backoff = Backoff(initial = 5.0, maximum = 30.0, timeout = timeout)
+            while (
+                len(self.available(cpu, ram, worker_size)) < self.size
+            ):
+                backoff.sleep()
+
+        return max(missing, 0)
+
+    def acquire(
+        self,
+        cluster_name: str,
+        cpu: int,
+        ram: int,
+        worker_size: int,
+        graceful_delete: int = 180,
+        timeout: int = None,
+        options: dict = None,
+    ):
+        """
+        claim a stopped pool instance by removing its pool labels, rename it to `cluster_name`
+        and start it.
+        `options` are extra environment variables for the startup script.
+
+        Returns
+        -------
+        result: instance dictionary after running, None if no instance available.
+        """
+        compute = compute_client()
+        claimed = None
+        for instance in self.available(cpu, ram, worker_size):
+            labels = {
+                k: v
+                for k, v in instance.get('labels', {}).items()
+                if k not in (POOL_LABEL, SHAPE_LABEL)
+            }
+            labels[CLUSTER_LABEL] = cluster_name
+            # `labelFingerprint` makes the claim atomic, only one caller can remove the pool
+            # labels, after that `available` no longer returns the instance.
+            try:
+                operation = execute(
+                    compute.instances().setLabels(
+                        project = self.project,
+                        zone = self.zone,
+                        instance = instance['name'],
+                        body = {
+                            'labelFingerprint': instance['labelFingerprint'],
+                            'labels': labels,
+                        },
+                    )
+                )
+                wait_for_operation(
+                    compute,
+                    self.project,
+                    self.zone,
+                    operation['name'],
+                    timeout = timeout,
+                )
+            except Exception:
+                continue
+            claimed = instance
+            break
+
+        # claimed instance is no longer counted, refill inserts its replacement.
+        if self.refill:
+            self._executor.submit(self.fill, cpu, ram, worker_size)
+
+        if claimed is None:
+            return None
+
+        try:
+            operation = execute(
+                compute.instances().setName(
+                    project = self.project,
+                    zone = self.zone,
+                    instance = claimed['name'],
+                    body = {
+                        'name': cluster_name,
+                        'currentName': claimed['name'],
+                    },
+                )
+            )
+            wait_for_operation(
+                compute,
+                self.project,
+                self.zone,
+                operation['name'],
+                timeout = timeout,
+            )
+        except Exception:
+            # claimed but not renamed, nobody else can use it.
+            execute(
+                compute.instances().delete(
+                    project = self.project,
+                    zone = self.zone,
+                    instance = claimed['name'],
+                )
+            )
+            raise
+
+        instance = get_instance(compute, self.project, self.zone, cluster_name)
+        startup_script = _startup_script(
+            cluster_name = cluster_name,
+            project = self.project,
+            zone = self.zone,
+            worker_size = worker_size,
+            graceful_delete = graceful_delete,
+            options = options,
+        )
+        operation = execute(
+            compute.instances().setMetadata(
+                project = self.project,
+                zone = self.zone,
+                instance = cluster_name,
+                body = {
+                    'fingerprint': instance['metadata']['fingerprint'],
+                    'items': [
+                        {'key': 'startup-script', 'value': startup_script},
+                        {'key': 'enable-guest-attributes', 'value': 'TRUE'},
+                    ],
+                },
+            )
+        )
+        wait_for_operation(
+            compute, self.project, self.zone, operation['name'], timeout = timeout
+        )
+
+        operation = execute(
+            compute.instances().start(
+                project = self.project, zone = self.zone, instance = cluster_name
+            )
+        )
+        wait_for_operation(
+            compute, self.project, self.zone, operation['name'], timeout = timeout
+        )
+        return wait_for_instance(
+            compute, self.project, self.zone, cluster_name, timeout = timeout
+        )
+
+    def drain(self, cpu: int, ram: int, worker_size: int):
+        """
+        delete all pool instances for a shape.
+        """
+        compute = compute_client()
+        operations = [
+            execute(
+                compute.instances().delete(
+                    project = self.project,
+                    zone = self.zone,
+                    instance = instance['name'],
+                )
+            )
+            for instance in self.instances(cpu, ram, worker_size)
+        ]
+        for operation in operations:
+            wait_for_operation(
+                compute, self.project, self.zone, operation['name']
+            )
+        return len(operations)
+
+    def close(self):
+        """
+        wait background refills to finish.
+        """
+        self._executor.shutdown(wait = True)
@@ -0,0 +1,287 @@
+import inspect
+import threading
+from datetime import datetime
+from herpetologist import check_type
+from .client import compute_client
+from .core import (
+    ROLE_LABEL,
+    _get_ip,
+    _spawn_async,
+    _wait_ready,
+    _webhook,
+    cluster_instances,
+    delete,
+    spawn,
+)
+from .function import dask_workers_async, post_slack, route, run_coroutine
+from .waiter import (
+    execute,
+    get_instance,
+    wait_for_instance,
+    wait_for_operation,
+)
+from . import notify, registry
+from typing import Callable
+
+
+class PreemptionWatcher:
+    """
+    Watch a preemptible dask cluster from client side, restart preempted instances with
+    the same name, shape and disk, or delete and spawn again if restart failed.
+    The scheduler is probed every `interval` seconds, api calls only happen if the probe failed.
+    A deleted cluster, eg, graceful delete, stops the watcher.
+
+    parameter
+    ---------
+
+    cluster_name: str
+        dask cluster name.
+    image_name: str
+        image name we built.
+    project: str
+        project id inside gcp.
+    zone: str
+        compute zone of the running cluster, spawn again in `fallback_zones` if no capacity.
+    cpu: int
+        cpu core count.
+    ram: int
+        ram size in term of MB.
+    worker_size: int
+        worker size of dask cluster.
+    interval: int, (default=15)
+        seconds between checks.
+    timeout: int, (default=900)
+        maximum seconds to wait a recovered cluster ready.
+    on_recover: Callable, (default=None)
+        called with spawn result, {'ip', 'internal_ip', ...}, after recovered.
+    webhook_function: Callable, (default=post_slack)
+        Callable function to send alert, default is post_slack.
+    **kwargs:
+        Keyword arguments to pass to `ondemand_dask.spawn` and webhook_function.
+    """
+
+    @check_type
+    def __init__(
+        self,
+        cluster_name: str,
+        image_name: str,
+        project: str,
+        zone: str,
+        cpu: int,
+        ram: int,
+        worker_size: int,
+        interval: int = 15,
+        timeout: int = 900,
+        on_recover = None,
+        webhook_function: Callable = post_slack,
+        **kwargs,
+    ):
+        self.cluster_name = cluster_name
+        self.project = project
+        self.zone = zone
+        self.interval = interval
+        self.timeout = timeout
+        self.on_recover = on_recover
+        self.spawn_kwargs = dict(
+            kwargs,
+            cluster_name = cluster_name,
+            image_name = image_name,
+            project = project,
+            zone = zone,
+            cpu = cpu,
+            ram = ram,
+            worker_size = worker_size,
+            webhook_function = webhook_function,
+            preemptible = True,
+            check_exist = False,
+        )
+        parameters = inspect.signature(spawn).parameters
+        webhook_kwargs = {
+            k: v for k, v in kwargs.items() if k not in parameters
+        }
+        self._post = _webhook(webhook_function, **webhook_kwargs)
+        self._key = (webhook_function, repr(sorted(webhook_kwargs.items())))
+        self.recovered = 0
+        self.ip = None
+        self.internal_ip = None
+        entry = registry.lookup(cluster_name, project, zone)
+        if entry:
+            self.ip, self.internal_ip = entry['ip'], entry['internal_ip']
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def host(self):
+        if not self.ip:
+            return None
+        return route(
+            self.ip,
+            self.internal_ip,
+            self.project,
+            self.spawn_kwargs.get('internal'),
+        )
+
+    @property
+    def address(self):
+        return f'tcp://{self.host}:8786' if self.ip else None
+
+    def _notify(self, msg):
+        notify.dispatcher().send(self._post, msg, key = self._key)
+
+    def _restart(self, compute, instances):
+        operations = [
+            execute(
+                compute.instances().start(
+                    project = self.project,
+                    zone = self.zone,
+                    instance = instance['name'],
+                )
+            )
+            for instance in instances
+        ]
+        for operation in operations:
+            wait_for_operation(
+                compute,
+                self.project,
+                self.zone,
+                operation['name'],
+                timeout = self.timeout,
+            )
+
+    def _recover(self, compute):
+        print(f'`{self.cluster_name}` preempted, recovering.')
+        self._notify(
+            f'Dask cluster `{self.cluster_name}` preempted at {datetime.now()}, recovering.'
+        )
+        try:
+            stopped = [
+                i
+                for i in cluster_instances(
+                    compute, self.project, self.zone, self.cluster_name
+                )
+                if i['status'] == 'TERMINATED'
+            ]
+            self._restart(compute, stopped)
+            instance = wait_for_instance(
+                compute,
+                self.project,
+                self.zone,
+                self.cluster_name,
+                timeout = self.timeout,
+            )
+            self.ip, self.internal_ip = ip_address, internal_ip = _get_ip(instance)
+            run_coroutine(
+                _wait_ready(
+                    self.host,
+                    timeout = self.timeout,
+                )
+            )
+            result = {
+                'ip': ip_address,
+                'internal_ip': internal_ip,
+                'zone': self.zone,
+                'address': self.address,
+            }
+            registry.record(
+                self.cluster_name,
+                self.project,
+                self.zone,
+                ip_address,
+                internal_ip,
+            )
+        except Exception as e:
+            # capacity may not be available for the same instances, start from scratch.
+            print(f'failed to restart `{self.cluster_name}`: {e}, spawning again.')
+            delete(
+                cluster_name = self.cluster_name,
+                project = self.project,
+                zone = self.zone,
+            )
+            result = run_coroutine(_spawn_async(**self.spawn_kwargs))
+            self.zone = self.spawn_kwargs['zone'] = result['zone']
+
+        self.ip, self.internal_ip = result['ip'], result['internal_ip']
+        self.recovered += 1
+        self._notify(
+            f'Dask cluster `{self.cluster_name}` recovered, dashboard http://{self.ip}:8787'
+        )
+        if self.on_recover is not None:
+            self.on_recover(result)
+        return result
+
+    def check(self):
+        """
+        check the cluster once, recover if preempted.
+
+        Returns
+        -------
+        result: str, one of 'healthy', 'recovered', 'deleted' and 'pending'.
+        """
+        workers = self.spawn_kwargs.get('workers', 0)
+        adaptive = self.spawn_kwargs.get('adaptive', False)
+        if self.ip:
+            registered = run_coroutine(dask_workers_async(self.host))
+            # multi-node cluster lost workers if less registered than expected.
+            expected = (
+                self.spawn_kwargs['worker_size'] * workers
+                if workers and not adaptive
+                else 0
+            )
+            if registered is not None and registered >= expected:
+                return 'healthy'
+
+        compute = compute_client()
+        scheduler = get_instance(
+            compute, self.project, self.zone, self.cluster_name
+        )
+        if scheduler is None:
+            return 'deleted'
+
+        if scheduler['status'] == 'TERMINATED':
+            self._recover(compute)
+            return 'recovered'
+
+        # adaptive multi-node clusters stop workers on purpose, the scaler starts them.
+        if scheduler['status'] == 'RUNNING' and workers and not adaptive:
+            stopped = [
+                i
+                for i in cluster_instances(
+                    compute, self.project, self.zone, self.cluster_name
+                )
+                if i['status'] == 'TERMINATED'
+                and i['labels'].get(ROLE_LABEL) == 'worker'
+            ]
+            if stopped:
+                print(f'{len(stopped)} workers of `{self.cluster_name}` preempted, restarting.')
+                self._restart(compute, stopped)
+                return 'recovered'
+
+        if scheduler['status'] == 'RUNNING':
+            self.ip, self.internal_ip = _get_ip(scheduler)
+            return 'healthy'
+        return 'pending'
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.check() == 'deleted':
+                    print(f'`{self.cluster_name}` deleted, stop watching.')
+                    return
+            except Exception as e:
+                print(f'preemption watcher error: {e}')
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target = self._run,
+                name = f'ondemand-dask-preemption-{self.cluster_name}',
+                daemon = True,
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout = 10)
@@ -0,0 +1,210 @@
+import contextlib
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+PATH = os.path.join(
+    os.path.expanduser('~'), '.cache', 'ondemand-dask', 'clusters.db'
+)
+TTL = 300
+
+_lock = threading.Lock()
+_initialized = set()
+
+
+@contextlib.contextmanager
+def _connect():
+    path = PATH
+    with _lock:
+        if path not in _initialized:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            with contextlib.closing(
+                sqlite3.connect(path, timeout = 30)
+            ) as conn, conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS clusters (
+                        project TEXT, zone TEXT, name TEXT,
+                        ip TEXT, internal_ip TEXT, status TEXT, shape TEXT,
+                        updated REAL,
+                        PRIMARY KEY (project, zone, name)
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS listings (
+                        project TEXT, zone TEXT, updated REAL,
+                        PRIMARY KEY (project, zone)
+                    )
+                    """
+                )
+            _initialized.add(path)
+    conn = sqlite3.connect(path, timeout = 30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _best_effort(default = None):
+    """
+    registry is only a cache, a broken or read-only database must not fail the caller.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except (sqlite3.Error, OSError) as e:
+                print(f'cluster registry `{PATH}` unavailable: {e}')
+                return default
+
+        return wrapper
+
+    return decorator
+
+
+def _entry(row):
+    project, zone, name, ip, internal_ip, status, shape, updated = row
+    return {
+        'cluster_name': name,
+        'project': project,
+        'zone': zone,
+        'ip': ip,
+        'internal_ip': internal_ip,
+        'status': status,
+        'shape': json.loads(shape or '{}'),
+        'updated': updated,
+    }
+
+
+@_best_effort()
+def record(
+    cluster_name: str,
+    project: str,
+    zone: str,
+    ip: str,
+    internal_ip: str,
+    status: str = 'RUNNING',
+    shape: dict = None,
+):
+    """
+    insert or update a cluster, `shape` merged with the recorded shape.
+    """
+    with _connect() as conn:
+        row = conn.execute(
+            'SELECT shape FROM clusters WHERE project = ? AND zone = ? AND name = ?',
+            (project, zone, cluster_name),
+        ).fetchone()
+        merged = json.loads(row[0] or '{}') if row else {}
+        merged.update(shape or {})
+        conn.execute(
+            'INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                project,
+                zone,
+                cluster_name,
+                ip,
+                internal_ip,
+                status,
+                json.dumps(merged, sort_keys = True),
+                time.time(),
+            ),
+        )
+
+
+@_best_effort()
+def lookup(cluster_name: str, project: str, zone: str, ttl: int = TTL):
+    """
+    cached cluster updated within `ttl` seconds, else None.
+    """
+    with _connect() as conn:
+        row = conn.execute(
+            'SELECT * FROM clusters WHERE project = ? AND zone = ? AND name = ? AND updated > ?',
+            (project, zone, cluster_name, time.time() - ttl),
+        ).fetchone()
+    return _entry(row) if row else None
+
+
+@_best_effort()
+def forget(cluster_name: str, project: str, zone: str):
+    with _connect() as conn:
+        conn.execute(
+            'DELETE FROM clusters WHERE project = ? AND zone = ? AND name = ?',
+            (project, zone, cluster_name),
+        )
+
+
+@_best_effort()
+def entries(project: str, zone: str, ttl: int = TTL):
+    """
+    cached clusters of a zone, None if the zone not listed within `ttl` seconds.
+    """
+    with _connect() as conn:
+        listed = conn.execute(
+            'SELECT updated FROM listings WHERE project = ? AND zone = ?',
+            (project, zone),
+        ).fetchone()
+        if not listed or listed[0] <= time.time() - ttl:
+            return None
+        rows = conn.execute(
+            'SELECT * FROM clusters WHERE project = ? AND zone = ? ORDER BY name',
+            (project, zone),
+        ).fetchall()
+    return [_entry(row) for row in rows]
+
+
+@_best_effort()
+def replace(project: str, zone: str, clusters: list):
+    """
+    replace every cached cluster of a zone after a full listing.
+    """
+    with _connect() as conn:
+        rows = {
+            name: shape
+            for name, shape in conn.execute(
+                'SELECT name, shape FROM clusters WHERE project = ? AND zone = ?',
+                (project, zone),
+            )
+        }
+        conn.execute(
+            'DELETE FROM clusters WHERE project = ? AND zone = ?',
+            (project, zone),
+        )
+        now = time.time()
+        for cluster in clusters:
+            shape = json.loads(rows.get(cluster['cluster_name']) or '{}')
+            shape.update(cluster.get('shape') or {})
+            conn.execute(
+                'INSERT INTO clusters VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    project,
+                    zone,
+                    cluster['cluster_name'],
+                    cluster['ip'],
+                    cluster['internal_ip'],
+                    cluster['status'],
+                    json.dumps(shape, sort_keys = True),
+                    now,
+                ),
+            )
+        conn.execute(
+            'INSERT OR REPLACE INTO listings VALUES (?, ?, ?)',
+            (project, zone, now),
+        )
+
+
+def clear():
+    """
+    drop every cached cluster.
+    """
+    with _connect() as conn:
+        conn.execute('DELETE FROM clusters')
+        conn.execute('DELETE FROM listings')
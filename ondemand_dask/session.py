@@ -0,0 +1,196 @@
+import contextlib
+import importlib
+import threading
+from herpetologist import check_type
+from .core import delete, spawn
+from .preemption import PreemptionWatcher
+
+
+def touch_scheduler(client):
+    """
+    reset idle timer of the cluster, so graceful delete does not happen while a client is open.
+    """
+    try:
+        client.sync(client.scheduler.touch)
+    except Exception:
+        # images built before the `touch` handler, touch the idle plugin directly.
+        client.run_on_scheduler(
+            lambda dask_scheduler: dask_scheduler.plugins[
+                'ondemand-idle'
+            ].touch()
+        )
+
+
+def _compression(compression):
+    # the scheduler decompresses anything the client sends, stay uncompressed if the
+    # codec is not installed locally.
+    if compression == 'none':
+        return False
+    compression = 'lz4' if compression == 'auto' else compression
+    module = {'zstd': 'zstandard', 'lz4': 'lz4'}[compression]
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        print(f'`{module}` not installed, client traffic is not compressed.')
+        return False
+    return compression
+
+
+def _heartbeat(clients, stop, interval):
+    while not stop.wait(interval):
+        try:
+            touch_scheduler(clients[-1])
+        except Exception as e:
+            print(f'heartbeat failed: {e}')
+
+
+@contextlib.contextmanager
+@check_type
+def connect(
+    cluster_name: str,
+    image_name: str,
+    project: str,
+    zone: str,
+    cpu: int,
+    ram: int,
+    worker_size: int,
+    delete_on_exit: bool = False,
+    heartbeat: int = 60,
+    ready_workers: int = 0,
+    recover: bool = False,
+    client_kwargs: dict = {},
+    **kwargs,
+):
+    """
+    context manager to reuse a running dask cluster or spawn a new one, yield a connected
+    `dask.distributed.Client`. Require `distributed` installed.
+
+    parameter
+    ---------
+
+    cluster_name: str
+        dask cluster name.
+    image_name: str
+        image name we built.
+    project: str
+        project id inside gcp.
+    zone: str
+        compute zone for the cluster.
+    cpu: int
+        cpu core count.
+    ram: int
+        ram size in term of MB.
+    worker_size: int
+        worker size of dask cluster.
+    delete_on_exit: bool, (default=False)
+        if True, will delete the cluster after the context closed, useful for batch jobs.
+    heartbeat: int, (default=60)
+        seconds between heartbeats keeping the cluster alive while the context is open,
+        capped to a third of `graceful_delete`.
+    ready_workers: int, (default=0)
+        dask workers registered before yield the client. Default 0 connects the client
+        as soon as the scheduler is ready, while workers still starting.
+    recover: bool, (default=False)
+        if True, spawn preemptible instances and watch them using
+        `ondemand_dask.PreemptionWatcher`. After recovered, the yielded client is closed and
+        a new default client connects to the recovered cluster, dask collections use it
+        automatically, else get it using `dask.distributed.get_client()`.
+        Futures of a preempted cluster are lost, submit them again.
+    client_kwargs: dict, (default={})
+        Keyword arguments to pass to `dask.distributed.Client`. The client connects to
+        internal IP if this machine runs inside the same VPC, see `internal` of `ondemand_dask.spawn`,
+        and compresses traffic using `compression` if the codec installed locally.
+    **kwargs:
+        Keyword arguments to pass to `ondemand_dask.spawn`.
+
+    Returns
+    -------
+    result: dask.distributed.Client
+    """
+
+    try:
+        import dask
+        from distributed import Client
+    except ImportError:
+        raise Exception(
+            '`connect` requires `distributed` installed, `pip install distributed`.'
+        )
+
+    if heartbeat < 1:
+        raise Exception('heartbeat must be bigger than 0')
+
+    kwargs.setdefault('check_exist', True)
+    if recover:
+        kwargs['preemptible'] = True
+    result = spawn(
+        cluster_name = cluster_name,
+        image_name = image_name,
+        project = project,
+        zone = zone,
+        cpu = cpu,
+        ram = ram,
+        worker_size = worker_size,
+        ready_workers = ready_workers,
+        **kwargs,
+    )
+    # `zone` may be a region, or the cluster spawned in one of `fallback_zones`.
+    fallback_zones = [zone] + list(kwargs.get('fallback_zones', []))
+    zone = result['zone']
+    interval = min(heartbeat, max(kwargs.get('graceful_delete', 180) // 3, 1))
+
+    clients = []
+    stop = threading.Event()
+    thread = None
+    watcher = None
+    config = dask.config.set(
+        {
+            'distributed.comm.compression': _compression(
+                kwargs.get('compression', 'auto')
+            )
+        }
+    )
+    try:
+        clients.append(Client(result['address'], **client_kwargs))
+        if recover:
+
+            def on_recover(recovered):
+                clients[-1].close()
+                clients.append(Client(recovered['address'], **client_kwargs))
+
+            kwargs.pop('check_exist')
+            kwargs.pop('preemptible')
+            kwargs['fallback_zones'] = fallback_zones
+            watcher = PreemptionWatcher(
+                cluster_name = cluster_name,
+                image_name = image_name,
+                project = project,
+                zone = zone,
+                cpu = cpu,
+                ram = ram,
+                worker_size = worker_size,
+                on_recover = on_recover,
+                ready_workers = ready_workers,
+                **kwargs,
+            )
+            watcher.ip = result['ip']
+            watcher.internal_ip = result['internal_ip']
+            watcher.start()
+        thread = threading.Thread(
+            target = _heartbeat,
+            args = (clients, stop, interval),
+            name = f'ondemand-dask-heartbeat-{cluster_name}',
+            daemon = True,
+        )
+        thread.start()
+        yield clients[0]
+    finally:
+        stop.set()
+        if watcher is not None:
+            watcher.stop()
+        if thread is not None:
+            thread.join(timeout = 10)
+        for client in clients:
+            client.close()
+        config.__exit__(None, None, None)
+        if delete_on_exit:
+            delete(cluster_name = cluster_name, project = project, zone = zone)
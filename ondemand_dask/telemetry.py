@@ -0,0 +1,224 @@
+import json
+import math
+from herpetologist import check_type
+from .client import storage_client
+from .core import worker_resources
+
+PREFIX = 'ondemand-dask-telemetry'
+# recommended shape keeps cores this busy at 95th percentile.
+CPU_TARGET = 0.75
+MAX_CPU = 96
+
+
+def _percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+
+
+def _even(cpu):
+    # custom machine types accept 1 or an even vCPU count.
+    cpu = min(max(int(math.ceil(cpu)), 1), MAX_CPU)
+    return cpu if cpu == 1 else cpu + cpu % 2
+
+
+@check_type
+def load_telemetry(
+    cluster_name: str,
+    bucket_name: str,
+    prefix: str = PREFIX,
+    history: int = 5,
+):
+    """
+    load latest telemetry written by clusters spawned with `telemetry_bucket`.
+
+    parameter
+    ---------
+
+    cluster_name: str
+        dask cluster name.
+    bucket_name: str
+        `telemetry_bucket` passed to `ondemand_dask.spawn`.
+    prefix: str, (default='ondemand-dask-telemetry')
+        prefix inside the bucket.
+    history: int, (default=5)
+        latest cluster runs to load.
+
+    Returns
+    -------
+    list: [{'cluster_name', 'started', 'finished', 'reason', 'shape', 'samples': [dict]}], oldest first.
+    """
+
+    blobs = storage_client().list_blobs(
+        bucket_name, prefix = f'{prefix.strip("/")}/{cluster_name}/'
+    )
+    blobs = sorted(blobs, key = lambda blob: blob.name)[-history:]
+    runs = []
+    for blob in blobs:
+        run = json.loads(blob.download_as_bytes())
+        columns = run.pop('columns')
+        run['samples'] = [dict(zip(columns, row)) for row in run.pop('rows')]
+        runs.append(run)
+    return runs
+
+
+@check_type
+def recommend_shape(
+    cluster_name: str,
+    bucket_name: str,
+    prefix: str = PREFIX,
+    history: int = 5,
+):
+    """
+    recommend `cpu`, `ram`, `worker_size` and `threads_per_worker` for the next spawn,
+    from telemetry of latest runs. Only samples with running tasks are used, so idle time
+    before graceful delete does not shrink the shape.
+
+    parameter
+    ---------
+
+    cluster_name: str
+        dask cluster name.
+    bucket_name: str
+        `telemetry_bucket` passed to `ondemand_dask.spawn`.
+    prefix: str, (default='ondemand-dask-telemetry')
+        prefix inside the bucket.
+    history: int, (default=5)
+        latest cluster runs to use.
+
+    Returns
+    -------
+    dictionary: {'shape': {'cpu', 'ram', 'worker_size', 'threads_per_worker'}, 'current', 'reasons', 'stats'}
+    """
+
+    runs = load_telemetry(
+        cluster_name = cluster_name,
+        bucket_name = bucket_name,
+        prefix = prefix,
+        history = history,
+    )
+    if not runs:
+        raise Exception(
+            f'no telemetry for `{cluster_name}` in gs://{bucket_name}/{prefix}/, '
+            'spawn with `telemetry_bucket` first.'
+        )
+
+    current = runs[-1]['shape']
+    cpu = current['cpu']
+    worker_size = current['worker_size']
+    threads_per_worker = current.get('threads_per_worker') or 1
+    # multi-node clusters use the same shape for every worker instance.
+    instances = max(current.get('workers') or 0, 1)
+
+    samples = [s for run in runs for s in run['samples'] if s['workers']]
+    busy = [s for s in samples if s['processing']]
+    stats = {'runs': len(runs), 'samples': len(samples), 'busy_samples': len(busy)}
+    if not busy:
+        return {
+            'shape': {
+                'cpu': cpu,
+                'ram': current['ram'],
+                'worker_size': worker_size,
+                'threads_per_worker': threads_per_worker,
+            },
+            'current': current,
+            'reasons': ['cluster was never busy, keep the current shape.'],
+            'stats': stats,
+        }
+
+    # per instance, `cpu` is summed percent, 100 is one core.
+    cores = _percentile(
+        [s['cpu'] / 100 / instances for s in busy], 0.95
+    )
+    worker_cpu = _percentile([s['cpu_max'] for s in busy], 0.95)
+    memory_fraction = max(s['memory_max'] for s in busy)
+    spilled = max(s['spilled'] for s in samples)
+    worker_memory = max(
+        s['memory_max'] * s['memory_limit'] / s['workers'] for s in busy
+    )
+    saturated = cores >= 0.9 * cpu
+    pressure = spilled > 0 or memory_fraction >= 0.7
+
+    # completed tasks counter restarts with every cluster, use the latest run.
+    completed = [(s['time'], s['completed']) for s in runs[-1]['samples']]
+    stats.update(
+        {
+            'cores_p95': round(cores, 2),
+            'worker_cpu_p95': round(worker_cpu, 1),
+            'worker_memory_peak_mb': int(worker_memory / 2 ** 20),
+            'worker_memory_peak_fraction': memory_fraction,
+            'spilled_peak_mb': int(spilled / 2 ** 20),
+        }
+    )
+    if len(completed) > 1 and completed[-1][0] > completed[0][0]:
+        stats['tasks_per_second'] = round(
+            (completed[-1][1] - completed[0][1])
+            / (completed[-1][0] - completed[0][0]),
+            2,
+        )
+
+    reasons = []
+    if saturated:
+        new_cpu = _even(cpu * 2)
+        reasons.append(
+            f'cores saturated, {cores:.1f} of {cpu} busy at p95, double cpu.'
+        )
+    else:
+        new_cpu = _even(cores / CPU_TARGET)
+        if new_cpu < cpu:
+            reasons.append(
+                f'only {cores:.1f} of {cpu} cores busy at p95, shrink cpu.'
+            )
+        elif new_cpu > cpu:
+            reasons.append(f'{cores:.1f} of {cpu} cores busy at p95, grow cpu.')
+
+    # threads inside a process share the GIL, a worker never above one core is GIL bound.
+    if threads_per_worker > 1 and worker_cpu <= 120:
+        new_threads = 1
+        reasons.append(
+            f'workers peaked at {worker_cpu:.0f}% cpu with {threads_per_worker} threads, '
+            'GIL bound, use one thread per process.'
+        )
+    elif pressure:
+        new_threads = min(2, new_cpu)
+        reasons.append(
+            'workers spilled or hit the spill threshold, use fewer bigger workers.'
+        )
+    else:
+        new_threads = min(threads_per_worker, new_cpu)
+    new_worker_size = max(1, new_cpu // new_threads)
+
+    # memory grows with tasks running together inside a worker.
+    needed = worker_memory / 2 ** 20 * new_threads / threads_per_worker
+    needed = needed / (0.6 if pressure else 0.7)
+    needed = max(int(math.ceil(needed)), 256)
+    ram = max(new_cpu * 1024, 1024)
+    ram = int(math.ceil(ram / 256)) * 256
+    while (
+        worker_resources(cpu = new_cpu, ram = ram, worker_size = new_worker_size)[
+            'memory_limit'
+        ]
+        < needed
+    ):
+        ram += 256
+    if ram > current['ram']:
+        reasons.append(
+            f'workers need {needed} MB each with headroom, grow ram.'
+        )
+    elif ram < current['ram']:
+        reasons.append(
+            f'workers need {needed} MB each with headroom, shrink ram.'
+        )
+
+    return {
+        'shape': {
+            'cpu': new_cpu,
+            'ram': ram,
+            'worker_size': new_worker_size,
+            'threads_per_worker': new_threads,
+        },
+        'current': current,
+        'reasons': reasons,
+        'stats': stats,
+    }
@@ -1,20 +1,42 @@
-from google.cloud import storage
-import googleapiclient.discovery
-import shutil
+import contextvars
+import hashlib
+import io
+import json
 import os
-import time
-from .function import port_open, post_slack
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from .client import compute_client, storage_client
+from .function import dask_workers_async, post_slack, run_coroutine
+from .metrics import Timings
+from .notify import deliver
+from .waiter import (
+    Backoff,
+    execute,
+    wait_for_global_operation,
+    wait_for_instance,
+    wait_for_operation,
+)
 from .libraries import extra_libraries, important_libraries
+from .wheelhouse import Wheelhouse, python_key
+from googleapiclient.errors import HttpError
 from herpetologist import check_type
-import subprocess
 import cloudpickle
 from typing import Callable, List
 
 
 additional_command = [
-    'gsutil cp gs://general-bucket/dask.zip dask.zip',
+    'until gsutil cp gs://general-bucket/general-archive dask.zip; do sleep 2; done',
     'unzip dask.zip',
-    'worker_size=1 name=a project=a zone=a expired=99999 docker-compose -f docker-compose.yaml up --build',
+    # build only wheels missing from the wheelhouse, using the same python as the Dockerfile.
+    'mkdir -p dask/wheelhouse',
+    'gsutil -m rsync gs://general-wheelhouse dask/wheelhouse || true',
+    'docker run --rm -v $PWD/dask:/dask general-python pip wheel --find-links /dask/wheelhouse -w /dask/wheelhouse -r /dask/requirements.txt',
+    'gsutil -m rsync -x ".*\\.gitkeep$" dask/wheelhouse gs://general-wheelhouse',
+    # pre-bake docker image into the disk image, spawned instances only run `up`.
+    'docker-compose -f docker-compose.yaml build',
+    'worker_size=1 name=a project=a zone=a expired=99999 docker-compose -f docker-compose.yaml up',
 ]
 dask_network = {
     'allowed': [{'IPProtocol': 'tcp', 'ports': ['8787', '8786']}],
@@ -26,6 +48,63 @@ dask_network = {
     'sourceRanges': ['0.0.0.0/0'],
     'targetTags': ['dask'],
 }
+HASH_LABEL = 'ondemand-dask-hash'
+
+
+def image_files(directory, generated = None):
+    """
+    read every file inside `directory` as {relative path: bytes}, overwritten by `generated`.
+    """
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [d for d in dirs if d != '__pycache__']
+        for name in names:
+            if name.endswith('.pyc'):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as fopen:
+                files[os.path.relpath(path, directory).replace(os.sep, '/')] = (
+                    fopen.read()
+                )
+    files.update(generated or {})
+    return files
+
+
+def content_hash(files, extra = None):
+    """
+    sha256 over files and `extra` values, stable across machines.
+    """
+    h = hashlib.sha256()
+    for path in sorted(files):
+        h.update(path.encode('utf-8'))
+        h.update(files[path])
+    h.update(json.dumps(extra, sort_keys = True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def archive(files):
+    """
+    zip files in memory with fixed timestamps, same files always produce same bytes.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for path in sorted(files):
+            info = zipfile.ZipInfo(path, date_time = (2020, 1, 1, 0, 0, 0))
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            z.writestr(info, files[path])
+    return buffer.getvalue()
+
+
+def upload_archive(bucket, name, data, chunk_size = 8 * 1024 * 1024):
+    """
+    resumable upload in `chunk_size` chunks, skip if the content addressed blob exists.
+    """
+    blob = bucket.blob(name, chunk_size = chunk_size)
+    if blob.exists():
+        return blob
+    blob.upload_from_file(io.BytesIO(data), size = len(data))
+    return blob
 
 
 @check_type
@@ -46,6 +125,8 @@ def build_image(
     additional_libraries: List[str] = extra_libraries,
     install_bash: str = None,
     dockerfile: str = None,
+    force: bool = False,
+    wheelhouse: str = None,
     **kwargs,
 ):
     """
@@ -62,7 +143,8 @@ def build_image(
     family: str
         family name for built image
     instance_name: str (default='build-dask-instance')
-        Start-up instance to build the image
+        name prefix of start-up instance to build the image, suffixed by build hash,
+        so builds can run concurrently.
     source_image: dict (default={'project': 'ubuntu-os-cloud', 'family': 'ubuntu-1804-lts'})
         Source image to start the instance for building the image
     storage_image: str, (default='asia-southeast1')
@@ -78,6 +160,13 @@ def build_image(
         File path to custom start-up script to build disk image
     dockerfile: List[str], (default=None). 
         File path to custom Dockerfile to build docker image
+    force: bool, (default=False)
+        if False, will skip building if `image_name` in `family` built from the same
+        requirements, Dockerfile, install script, dask code and webhook.
+    wheelhouse: str, (default=None)
+        `gs://` location or local directory to cache built wheels, keyed by python version
+        of the Dockerfile. A local directory is staged through `gs://{bucket_name}/wheelhouse`.
+        If None, will use `gs://{bucket_name}/wheelhouse`.
     **kwargs:
         Keyword arguments to pass to webhook_function.
     """
@@ -85,194 +174,265 @@ def build_image(
     def nested_post(msg):
         return webhook_function(msg, **kwargs)
 
-    if validate_webhook:
-        if nested_post('Testing from ondemand-dask') != 200:
-            raise Exception('`webhook_function` must returned 200.')
-
-    compute = googleapiclient.discovery.build('compute', 'v1')
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-
-    this_dir = os.path.dirname(__file__)
-    pkl = os.path.join(this_dir, 'image', 'dask', 'post.pkl')
-    with open(pkl, 'wb') as fopen:
-        cloudpickle.dump(nested_post, fopen)
-
-    reqs = important_libraries + additional_libraries
-    reqs = list(set(reqs))
-
-    req = os.path.join(this_dir, 'image', 'dask', 'requirements.txt')
-    with open(req, 'w') as fopen:
-        fopen.write('\n'.join(reqs))
-
-    if dockerfile:
-        with open(dockerfile, 'r') as fopen:
-            script = fopen.read()
-        dockerfile_path = os.path.join(this_dir, 'image', 'dask', 'Dockerfile')
-        with open(dockerfile_path, 'w') as fopen:
-            fopen.write(script)
-
-    image = os.path.join(this_dir, 'image')
-    shutil.make_archive('dask', 'zip', image)
-    blob = bucket.blob('dask.zip')
-    blob.upload_from_filename('dask.zip')
-    os.remove('dask.zip')
-    image_response = (
-        compute.images()
-        .getFromFamily(**source_image)
-        .execute()
-    )
-    source_disk_image = image_response['selfLink']
-
-    try:
-        print('Creating `dask-network` firewall rule.')
-        compute.firewalls().insert(
-            project = project, body = dask_network
-        ).execute()
-        print('Done.')
-    except:
-        print('`dask-network` exists.')
-
-    machine_type = f'zones/{zone}/machineTypes/n1-standard-1'
-
-    if install_bash is None:
-        install_bash = 'install.sh'
-        install_bash = os.path.join(this_dir, install_bash)
-
-    startup_script = open(install_bash).read()
-    startup_script = '\n'.join(
-        startup_script.split('\n') + additional_command
-    ).replace('general-bucket', bucket_name)
-
-
-
-    config = {
-        'name': instance_name,
-        'tags': {'items': ['dask']},
-        'machineType': machine_type,
-        'disks': [
-            {
-                'boot': True,
-                'autoDelete': True,
-                'initializeParams': {'sourceImage': source_disk_image},
-            }
-        ],
-        'networkInterfaces': [
-            {
-                'network': 'global/networks/default',
-                'accessConfigs': [
-                    {'type': 'ONE_TO_ONE_NAT', 'name': 'External NAT'}
+    with Timings('build_image', image_name) as timings:
+        compute = compute_client()
+        bucket = storage_client().bucket(bucket_name)
+
+        this_dir = os.path.dirname(__file__)
+
+        reqs = important_libraries + additional_libraries
+        reqs = sorted(set(reqs))
+
+        with open(os.path.join(this_dir, 'notify.py'), 'rb') as fopen:
+            notify_script = fopen.read()
+        with open(os.path.join(this_dir, 'cache.py'), 'rb') as fopen:
+            cache_script = fopen.read()
+
+        generated = {
+            'dask/post.pkl': cloudpickle.dumps(nested_post),
+            'dask/notify.py': notify_script,
+            'dask/cache.py': cache_script,
+            'dask/requirements.txt': '\n'.join(reqs).encode('utf-8'),
+        }
+        if dockerfile:
+            with open(dockerfile, 'rb') as fopen:
+                generated['dask/Dockerfile'] = fopen.read()
+
+        image = os.path.join(this_dir, 'image')
+        files = image_files(image, generated)
+        script = files['dask/Dockerfile'].decode('utf-8')
+
+        python_image, python_tag = python_key(script)
+        staging = f'gs://{bucket_name}/wheelhouse/{python_tag}'
+        if wheelhouse is None:
+            wheelhouse = staging
+        else:
+            wheelhouse = f'{wheelhouse.rstrip("/")}/{python_tag}'
+
+        if install_bash is None:
+            install_bash = 'install.sh'
+            install_bash = os.path.join(this_dir, install_bash)
+
+        with open(install_bash) as fopen:
+            install_script = fopen.read()
+
+        # pickled webhook embeds local paths and python bytecode, hash its identity instead.
+        build_hash = content_hash(
+            {k: v for k, v in files.items() if k != 'dask/post.pkl'},
+            extra = {
+                'install': install_script,
+                'source_image': source_image,
+                'command': additional_command,
+                'webhook': [
+                    webhook_function.__module__,
+                    webhook_function.__qualname__,
+                    repr(sorted(kwargs.items())),
                 ],
-            }
-        ],
-        'serviceAccounts': [
-            {
-                'email': 'default',
-                'scopes': [
-                    'https://www.googleapis.com/auth/devstorage.read_write',
-                    'https://www.googleapis.com/auth/logging.write',
-                    'https://www.googleapis.com/auth/compute',
-                ],
-            }
-        ],
-        'metadata': {
-            'items': [
-                {'key': 'startup-script', 'value': startup_script},
-                {'key': 'bucket', 'value': bucket_name},
-            ]
-        },
-    }
-
-    operation = (
-        compute.instances()
-        .insert(project = project, zone = zone, body = config)
-        .execute()
-    )
-
-    print(f'Waiting instance `{instance_name}` to run.')
-
-    while True:
-        result = (
-            compute.zoneOperations()
-            .get(project = project, zone = zone, operation = operation['name'])
-            .execute()
+            },
+        )[:40]
+        timings.lap('package')
+
+        def built():
+            result = execute(
+                compute.images().list(
+                    project = project,
+                    filter = f'(labels.{HASH_LABEL} = "{build_hash}") '
+                    f'(family = "{family}")',
+                )
+            )
+            return any(i['name'] == image_name for i in result.get('items', []))
+
+        if not force and built():
+            print(f'Image `{image_name}` built from the same content, skip.')
+            timings.lap('cache')
+            return True
+
+        if validate_webhook:
+            if not deliver(nested_post, 'Testing from ondemand-dask'):
+                raise Exception('`webhook_function` must returned 200.')
+
+        timings.lap('cache')
+
+        cache = Wheelhouse(wheelhouse)
+        # builder instance syncs wheels using `gsutil`, a local wheelhouse is staged in the bucket.
+        remote = cache if cache.is_gcs else Wheelhouse(staging)
+        missing = cache.missing(reqs)
+        print(
+            f'{len(reqs) - len(missing)} of {len(reqs)} requirements cached in `{wheelhouse}`.'
         )
 
-        if result['status'] == 'DONE':
-            if 'error' in result:
-                raise Exception(result['error'])
-            else:
-                print('Done.')
-            break
+        def stage(data):
+            if not cache.is_gcs:
+                with tempfile.TemporaryDirectory() as directory:
+                    cache.download(directory)
+                    remote.upload(directory)
+            upload_archive(bucket, archive_name, data)
+
+        # builder instance waits for the archive, so upload, firewall and insert run together.
+        archive_name = f'dask-{build_hash}.zip'
+        executor = ThreadPoolExecutor(max_workers = 2)
+        print(f'Uploading `{archive_name}`.')
+        uploading = executor.submit(
+            contextvars.copy_context().run, stage, archive(files)
+        )
+
+        def create_firewall():
+            try:
+                execute(
+                    compute.firewalls().insert(
+                        project = project, body = dask_network
+                    )
+                )
+                print('Created `dask-network` firewall rule.')
+            except HttpError as e:
+                if int(e.resp.status) != 409:
+                    raise
+                print('`dask-network` exists.')
+
+        firewall = executor.submit(
+            contextvars.copy_context().run, create_firewall
+        )
+        executor.shutdown(wait = False)
+
+        image_response = execute(compute.images().getFromFamily(**source_image))
+        source_disk_image = image_response['selfLink']
 
-        time.sleep(1)
+        machine_type = f'zones/{zone}/machineTypes/n1-standard-1'
 
-    print('Waiting IP Address to check health.')
+        startup_script = (
+            '\n'.join(install_script.split('\n') + additional_command)
+            .replace('general-bucket', bucket_name)
+            .replace('general-archive', archive_name)
+            .replace('gs://general-wheelhouse', remote.location)
+            .replace('general-python', python_image)
+        )
 
-    while True:
-        result = (
-            compute.instances().list(project = project, zone = zone).execute()
+        # concurrent builds, even from the same content, use their own builder instance.
+        builder = f'{instance_name}-{build_hash[:8]}-{uuid.uuid4().hex[:6]}'
+        config = {
+            'name': builder,
+            'tags': {'items': ['dask']},
+            'machineType': machine_type,
+            'disks': [
+                {
+                    'boot': True,
+                    'autoDelete': True,
+                    'initializeParams': {'sourceImage': source_disk_image},
+                }
+            ],
+            'networkInterfaces': [
+                {
+                    'network': 'global/networks/default',
+                    'accessConfigs': [
+                        {'type': 'ONE_TO_ONE_NAT', 'name': 'External NAT'}
+                    ],
+                }
+            ],
+            'serviceAccounts': [
+                {
+                    'email': 'default',
+                    'scopes': [
+                        'https://www.googleapis.com/auth/devstorage.read_write',
+                        'https://www.googleapis.com/auth/logging.write',
+                        'https://www.googleapis.com/auth/compute',
+                    ],
+                }
+            ],
+            'metadata': {
+                'items': [
+                    {'key': 'startup-script', 'value': startup_script},
+                    {'key': 'bucket', 'value': bucket_name},
+                ]
+            },
+        }
+
+        operation = execute(
+            compute.instances().insert(project = project, zone = zone, body = config)
         )
-        results = result['items'] if 'items' in result else None
-        dask = [r for r in results if r['name'] == instance_name]
-        if len(dask) > 0:
-            dask = dask[0]
-            ip_address = dask['networkInterfaces'][0]['accessConfigs'][0][
-                'natIP'
-            ]
+        try:
+            print(f'Waiting instance `{builder}` to run.')
+            wait_for_operation(compute, project, zone, operation['name'])
+            timings.lap('builder')
+            print('Done.')
+
+            uploading.result()
+            firewall.result()
+            timings.lap('upload')
+            print(f'Uploaded `{archive_name}`.')
+
+            print('Waiting IP Address to check health.')
+            instance = wait_for_instance(compute, project, zone, builder)
+            ip_address = instance['networkInterfaces'][0]['accessConfigs'][0]['natIP']
+            timings.lap('ip')
             print(f'Got it, Public IP: {ip_address}')
-            break
 
-        time.sleep(2)
+            print('Waiting Dask cluster to run.')
+            # a registered worker proves the baked image runs, not only the scheduler port.
+            backoff = Backoff(initial = 1.0, maximum = 5.0)
+            while True:
+                if (run_coroutine(dask_workers_async(ip_address)) or 0) >= 1:
+                    print('Done.')
+                    break
+                backoff.sleep()
+            timings.lap('ready')
+
+            if not cache.is_gcs:
+                # builder synced new wheels before building the docker image.
+                with tempfile.TemporaryDirectory() as directory:
+                    remote.download(directory)
+                    copied = cache.upload(directory)
+                print(f'Copied {len(copied)} new wheels into `{wheelhouse}`.')
+
+            # another process may have built the same content while this one was building.
+            if not force and built():
+                print(f'Image `{image_name}` built from the same content, skip.')
+                return True
+
+            print(f'Deleting image `{image_name}` if exists.')
+            try:
+                operation = execute(
+                    compute.images().delete(project = project, image = image_name)
+                )
+                wait_for_global_operation(compute, project, operation['name'])
+                print('Done.')
+            except HttpError as e:
+                if int(e.resp.status) != 404:
+                    raise
+
+            print(f'Building image `{image_name}`.')
+            # forceCreate allows imaging the boot disk while the builder instance is running.
+            try:
+                operation = execute(
+                    compute.images().insert(
+                        project = project,
+                        forceCreate = True,
+                        body = {
+                            'name': image_name,
+                            'family': family,
+                            'sourceDisk': f'zones/{zone}/disks/{builder}',
+                            'storageLocations': [storage_image],
+                            'labels': {HASH_LABEL: build_hash},
+                        },
+                    )
+                )
+            except HttpError as e:
+                # a concurrent build of the same content inserted it first.
+                if int(e.resp.status) != 409 or not built():
+                    raise
+                print(f'Image `{image_name}` built by another process.')
+                return True
+            wait_for_global_operation(compute, project, operation['name'])
+            print('Done.')
 
-    print('Waiting Dask cluster to run.')
-    while True:
-        if port_open(ip_address, 8786) and port_open(ip_address, 8787):
+            timings.lap('image')
+        finally:
+            # builder loops forever waiting the archive if upload failed, always delete it.
+            print(f'Deleting instance `{builder}`.')
+            execute(
+                compute.instances().delete(
+                    project = project, zone = zone, instance = builder
+                )
+            )
+            timings.lap('cleanup')
             print('Done.')
-            break
-        time.sleep(5)
-
-    compute = googleapiclient.discovery.build('compute', 'v1')
-    print(f'Deleting image `{image_name}` if exists.')
-    try:
-        compute.images().delete(project = project, image = image_name).execute()
-        print('Done.')
-    except:
-        pass
-
-    # give a rest to gcp API before build the image.
-    time.sleep(20)
-
-    print(f'Building image `{image_name}`.')
-    try:
-        o = subprocess.check_output(
-            [
-                'gcloud',
-                'compute',
-                'images',
-                'create',
-                image_name,
-                '--source-disk',
-                instance_name,
-                '--source-disk-zone',
-                zone,
-                '--family',
-                family,
-                '--storage-location',
-                storage_image,
-                '--force',
-            ],
-            stderr = subprocess.STDOUT,
-        )
-        print('Done.')
-    except subprocess.CalledProcessError as e:
-        print(e.output.decode('utf-8'))
-        raise
-
-    print(f'Deleting instance `{instance_name}`.')
-    compute = googleapiclient.discovery.build('compute', 'v1')
-    compute.instances().delete(
-        project = project, zone = zone, instance = instance_name
-    ).execute()
-    print('Done.')
-    return True
+        return True
@@ -0,0 +1,260 @@
+import json
+import random
+import re
+import threading
+import time
+from googleapiclient.errors import HttpError
+from .client import authorized_http
+from . import metrics
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {
+    'rateLimitExceeded',
+    'userRateLimitExceeded',
+    'quotaExceeded',
+}
+# insert errors which may not happen in another zone.
+CAPACITY_ERRORS = {
+    'ZONE_RESOURCE_POOL_EXHAUSTED',
+    'ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS',
+    'RESOURCE_POOL_EXHAUSTED',
+    'QUOTA_EXCEEDED',
+    'UNSUPPORTED_OPERATION',
+    'resourceNotReady',
+    'resourceExhausted',
+}
+
+_limiters_lock = threading.Lock()
+_limiters = {}
+
+
+class Backoff:
+    """
+    exponential backoff with jitter, raise TimeoutError after `timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        initial: float = 1.0,
+        maximum: float = 30.0,
+        multiplier: float = 2.0,
+        timeout: float = None,
+    ):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.timeout = timeout
+        self.deadline = (
+            time.monotonic() + timeout if timeout is not None else None
+        )
+        self._current = initial
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def next(self):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise TimeoutError(f'deadline exceeded after {self.timeout} seconds')
+        delay = self._current / 2 + random.uniform(0, self._current / 2)
+        self._current = min(self._current * self.multiplier, self.maximum)
+        if remaining is not None:
+            delay = min(delay, remaining)
+        return delay
+
+    def sleep(self):
+        time.sleep(self.next())
+
+
+class RateLimiter:
+    """
+    token bucket shared by threads, `pause` will block all callers after hit quota.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 10):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + seconds
+            )
+
+
+def rate_limiter(project: str = None):
+    """
+    get process-wide rate limiter for a project.
+    """
+    with _limiters_lock:
+        if project not in _limiters:
+            _limiters[project] = RateLimiter()
+        return _limiters[project]
+
+
+def set_rate_limit(project: str = None, rate: float = 10.0, burst: int = 10):
+    """
+    overwrite requests per second for a project, default is 10 requests per second.
+    """
+    with _limiters_lock:
+        _limiters[project] = RateLimiter(rate = rate, burst = burst)
+
+
+def _project(request):
+    found = re.search(r'/projects/([^/?]+)', getattr(request, 'uri', ''))
+    return found.group(1) if found else None
+
+
+def _classify(e):
+    status = int(e.resp.status)
+    try:
+        errors = json.loads(e.content.decode('utf-8'))['error']['errors']
+        reasons = {error.get('reason') for error in errors}
+    except:
+        reasons = set()
+    rate_limited = status == 429 or bool(reasons & RATE_LIMIT_REASONS)
+    retryable = status in RETRY_STATUS or rate_limited
+    return retryable, rate_limited
+
+
+def capacity_error(e):
+    """
+    True if an insert failed because the zone has no capacity or quota for the shape,
+    `e` raised by `execute` or by `wait_for_operation`.
+    """
+    if isinstance(e, HttpError):
+        try:
+            errors = json.loads(e.content.decode('utf-8'))['error']['errors']
+        except:
+            return False
+        codes = {error.get('reason') for error in errors}
+    elif e.args and isinstance(e.args[0], dict):
+        codes = {error.get('code') for error in e.args[0].get('errors', [])}
+    else:
+        return False
+    return bool(codes & CAPACITY_ERRORS)
+
+
+def execute(request, retries: int = 5):
+    """
+    execute a googleapiclient request using http connection owned by current thread,
+    httplib2 is not thread-safe so one compute client can be shared across threads.
+    Requests are rate limited per project and retried on quota and server errors.
+    """
+    limiter = rate_limiter(_project(request))
+    method = getattr(request, 'methodId', None)
+    backoff = Backoff()
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        metrics.api_call(method)
+        try:
+            return request.execute(http = authorized_http())
+        except HttpError as e:
+            retryable, rate_limited = _classify(e)
+            if not retryable or attempt == retries:
+                raise
+            metrics.retry(method, int(e.resp.status))
+            delay = backoff.next()
+            if rate_limited:
+                limiter.pause(delay)
+            time.sleep(delay)
+
+
+def get_instance(compute, project: str, zone: str, name: str):
+    """
+    get a single instance, return None if not exist.
+    """
+    try:
+        return execute(
+            compute.instances().get(
+                project = project, zone = zone, instance = name
+            )
+        )
+    except HttpError as e:
+        if int(e.resp.status) == 404:
+            return None
+        raise
+
+
+def wait_for_operation(
+    compute, project: str, zone: str, operation: str, timeout: float = None
+):
+    """
+    wait zone operation to finish using zoneOperations.wait, the server holds each call
+    up to 2 minutes so no client side polling needed.
+    """
+    backoff = Backoff(initial = 1.0, maximum = 10.0, timeout = timeout)
+    while True:
+        result = execute(
+            compute.zoneOperations().wait(
+                project = project, zone = zone, operation = operation
+            )
+        )
+        if result['status'] == 'DONE':
+            if 'error' in result:
+                raise Exception(result['error'])
+            return result
+
+        backoff.sleep()
+
+
+def wait_for_global_operation(
+    compute, project: str, operation: str, timeout: float = None
+):
+    """
+    wait global operation (images, firewalls) to finish using globalOperations.wait.
+    """
+    backoff = Backoff(initial = 1.0, maximum = 10.0, timeout = timeout)
+    while True:
+        result = execute(
+            compute.globalOperations().wait(
+                project = project, operation = operation
+            )
+        )
+        if result['status'] == 'DONE':
+            if 'error' in result:
+                raise Exception(result['error'])
+            return result
+
+        backoff.sleep()
+
+
+def wait_for_instance(
+    compute, project: str, zone: str, name: str, timeout: float = None
+):
+    """
+    wait a single instance to be RUNNING with public IP assigned, return the instance.
+    """
+    backoff = Backoff(initial = 1.0, maximum = 10.0, timeout = timeout)
+    while True:
+        instance = get_instance(compute, project, zone, name)
+        if instance and instance.get('status') == 'RUNNING':
+            interface = instance['networkInterfaces'][0]
+            access = interface.get('accessConfigs') or [{}]
+            if access[0].get('natIP') and interface.get('networkIP'):
+                return instance
+
+        backoff.sleep()
@@ -0,0 +1,114 @@
+import os
+import re
+import shutil
+from .client import storage_client
+
+
+def normalize(name):
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+
+def python_key(dockerfile):
+    """
+    wheelhouse key from first `FROM` of a Dockerfile, eg, `FROM python:3.7 AS base` -> ('python:3.7', 'python-3.7').
+    """
+    found = re.search(r'^\s*FROM\s+(\S+)', dockerfile, re.M | re.I)
+    image = found.group(1) if found else 'python:3.7'
+    return image, re.sub(r'[^a-z0-9.]+', '-', image.lower())
+
+
+class Wheelhouse:
+    """
+    Wheel cache keyed by python version, either `gs://bucket/prefix` or a local directory.
+    The builder instance syncs a GCS wheelhouse using `gsutil rsync`, a local directory is
+    staged through a GCS wheelhouse using `download` and `upload`.
+
+    parameter
+    ---------
+
+    location: str
+        `gs://bucket/prefix` or local directory path.
+    """
+
+    def __init__(self, location: str):
+        self.location = location.rstrip('/')
+        self.is_gcs = self.location.startswith('gs://')
+        if self.is_gcs:
+            bucket, _, prefix = self.location[len('gs://') :].partition('/')
+            self.bucket = storage_client().bucket(bucket)
+            self.prefix = f'{prefix}/' if prefix else ''
+        else:
+            os.makedirs(self.location, exist_ok = True)
+
+    def wheels(self):
+        """
+        list wheel file names inside the wheelhouse.
+        """
+        if self.is_gcs:
+            blobs = self.bucket.client.list_blobs(
+                self.bucket, prefix = self.prefix
+            )
+            names = [blob.name[len(self.prefix) :] for blob in blobs]
+        else:
+            names = os.listdir(self.location)
+        return sorted(n for n in names if n.endswith('.whl') and '/' not in n)
+
+    def missing(self, requirements):
+        """
+        requirements without a cached wheel. A pinned requirement needs the same version,
+        any version of an unpinned requirement counts as cached, the Dockerfile installs
+        it from the wheelhouse without PyPI.
+        """
+        cached = set()
+        for wheel in self.wheels():
+            name, version = wheel.split('-')[:2]
+            cached.add((normalize(name), version))
+        names = {name for name, _ in cached}
+
+        missing = []
+        for requirement in requirements:
+            found = re.match(
+                r'^\s*([A-Za-z0-9_.\-]+)(\[[^\]]*\])?\s*(==\s*([^\s;]+))?',
+                requirement,
+            )
+            if not found:
+                missing.append(requirement)
+            elif found.group(4):
+                if (normalize(found.group(1)), found.group(4)) not in cached:
+                    missing.append(requirement)
+            elif normalize(found.group(1)) not in names:
+                missing.append(requirement)
+        return missing
+
+    def download(self, directory):
+        """
+        copy all wheels into `directory`.
+        """
+        os.makedirs(directory, exist_ok = True)
+        for wheel in self.wheels():
+            target = os.path.join(directory, wheel)
+            if os.path.exists(target):
+                continue
+            if self.is_gcs:
+                self.bucket.blob(self.prefix + wheel).download_to_filename(
+                    target
+                )
+            else:
+                shutil.copyfile(os.path.join(self.location, wheel), target)
+
+    def upload(self, directory):
+        """
+        copy new wheels from `directory` into the wheelhouse, return copied file names.
+        """
+        existing = set(self.wheels())
+        copied = []
+        for wheel in sorted(os.listdir(directory)):
+            if not wheel.endswith('.whl') or wheel in existing:
+                continue
+            path = os.path.join(directory, wheel)
+            if self.is_gcs:
+                self.bucket.blob(self.prefix + wheel).upload_from_filename(path)
+            else:
+                shutil.copyfile(path, os.path.join(self.location, wheel))
+            copied.append(wheel)
+        return copied
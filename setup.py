@@ -8,7 +8,7 @@ setuptools.setup(
     packages = setuptools.find_packages(),
     include_package_data = True,
     version = '0.0.10',
-    python_requires = '>=3.6.*',
+    python_requires = '>=3.7',
     description = 'Dask cluster on demand and automatically delete itself after expired. Only support GCP for now.',
     author = 'huseinzol05',
     author_email = 'husein.zol05@gmail.com',